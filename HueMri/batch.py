@@ -0,0 +1,380 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+import profiling
+from engine import MODALITY_SUBTYPES, colorize, set_num_threads
+from loaders import (DICOM_EXTENSIONS, load_dicom_series, load_image, open_output,
+                     window_series)
+from resultcache import RESULT_CACHE_BYTES, ResultCache, result_key
+from volume import colorize_volume
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.npy')
+
+# DICOM slices colorized per volume pass, bounding a worker's output buffer
+SERIES_CHUNK = 64
+
+# This worker's ResultCache, set up by init_worker when caching is enabled
+_result_cache = None
+
+
+def find_images(input_dir):
+    """Yield paths of all supported images under input_dir, relative to it."""
+    for dirpath, dirnames, filenames in os.walk(input_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(dirpath, filename), input_dir)
+
+
+def is_up_to_date(src_path, dst_path):
+    return (os.path.exists(dst_path)
+            and os.path.getmtime(dst_path) >= os.path.getmtime(src_path))
+
+
+def init_worker(profile=False, cache_dir=None, cache_bytes=RESULT_CACHE_BYTES):
+    global _result_cache
+    # One worker per core already saturates the machine; keep OpenCV and
+    # the CLAHE bands from spawning thread pools inside every worker
+    set_num_threads(1)
+    if profile:
+        profiling.enable_memory_tracing()
+    if cache_dir is not None:
+        _result_cache = ResultCache(cache_dir, cache_bytes)
+
+
+def run_profiled(func, *args):
+    """Run a job and return (its result, the StageRecords of its stages)."""
+    records = []
+    hook = profiling.add_hook(records.append)
+    try:
+        return func(*args), records
+    finally:
+        profiling.remove_hook(hook)
+
+
+def find_dicom_series(input_dir):
+    """Yield the .dcm files of each directory under input_dir as one series, relative to it."""
+    for dirpath, dirnames, filenames in os.walk(input_dir):
+        dirnames.sort()
+        series = [os.path.relpath(os.path.join(dirpath, filename), input_dir)
+                  for filename in sorted(filenames)
+                  if filename.lower().endswith(DICOM_EXTENSIONS)]
+        if series:
+            yield series
+
+
+def output_path(output_dir, rel_path, output_format):
+    # Arrays and stacks cannot be encoded as images, so they stay .npy;
+    # DICOM slices are written as PNG
+    root, ext = os.path.splitext(rel_path)
+    if output_format == "npy" or ext.lower() == '.npy':
+        rel_path = root + '.npy'
+    elif ext.lower() in DICOM_EXTENSIONS:
+        rel_path = root + '.png'
+    return os.path.join(output_dir, rel_path)
+
+
+def write_result(image, dst_path, settings):
+    """Colorize an image or (N, H, W) stack into dst_path. Returns an error message or None."""
+    if dst_path.endswith('.npy'):
+        # Colorize straight into a memory-mapped array, slice by slice for
+        # (N, H, W) stacks; it only takes the final name once complete
+        partial_path = dst_path + '.partial'
+        out = open_output(partial_path, image.shape + (3,))
+        try:
+            if image.ndim == 3:
+                # Pool workers already use every core, so the stack is not threaded
+                colorize_volume(image, out=out, workers=1, **settings)
+            else:
+                colorize(image, out=out, **settings)
+            out.flush()
+        except BaseException:
+            del out
+            os.unlink(partial_path)
+            raise
+        del out
+        os.replace(partial_path, dst_path)
+        return None
+
+    if image.ndim != 2:
+        return "image stacks can only be written as .npy"
+    return save_image(colorize(image, **settings), dst_path)
+
+
+def save_image(result, dst_path):
+    """Write one colorized image as .npy or an encoded image. Returns an error message or None."""
+    os.makedirs(os.path.dirname(dst_path) or '.', exist_ok=True)
+    with profiling.stage('write', result):
+        if dst_path.endswith('.npy'):
+            np.save(dst_path, result)
+        elif not cv2.imwrite(dst_path, result):
+            return "could not write image"
+    return None
+
+
+def fetch_cached(image, settings, dst_path):
+    """Look up a result in this worker's cache. Returns (key, whether dst_path was written)."""
+    if _result_cache is None:
+        return None, False
+    suffix = os.path.splitext(dst_path)[1]
+    with profiling.stage('cache_lookup', image):
+        key = result_key(image, settings, suffix)
+        return key, _result_cache.fetch(key, suffix, dst_path)
+
+
+def store_cached(key, dst_path):
+    if key is not None:
+        _result_cache.store(key, os.path.splitext(dst_path)[1], dst_path)
+
+
+def process_file(src_path, dst_path, settings, dtype=np.uint8):
+    """Colorize one file, decoded as dtype.
+
+    Returns (images, megapixels, seconds, error, images served from the cache).
+    """
+    start = time.perf_counter()
+    try:
+        with profiling.stage('read') as record:
+            image = load_image(src_path, dtype)
+            record.output(image)
+    except ValueError as exc:
+        return 0, 0.0, time.perf_counter() - start, str(exc), 0
+
+    images = image.shape[0] if image.ndim == 3 else 1
+    key, cached = fetch_cached(image, settings, dst_path)
+    if cached:
+        return images, image.size / 1e6, time.perf_counter() - start, None, images
+    error = write_result(image, dst_path, settings)
+    if error:
+        return 0, 0.0, time.perf_counter() - start, error, 0
+    store_cached(key, dst_path)
+    return images, image.size / 1e6, time.perf_counter() - start, None, 0
+
+
+def process_series(src_paths, dst_paths, settings, window=(None, None), dtype=np.uint8,
+                   clahe_max_error=None):
+    """Colorize a DICOM series read in one bulk pass.
+
+    With clahe_max_error, 16-bit slices reuse CLAHE tables from the slice
+    before (see volume.colorize_volume). Returns (images, megapixels,
+    seconds, error, images served from the cache).
+    """
+    start = time.perf_counter()
+    # Each series is read once per run, so caching it would only hold memory
+    series = load_dicom_series(src_paths, cache=False)
+    volume = window_series(series, *window, dtype=dtype)
+    # Slices come back sorted along the scan axis
+    dst_for = dict(zip(map(os.path.abspath, src_paths), dst_paths))
+    slice_dsts = [dst_for[path] for path in series.paths]
+
+    # Approximate results must not be served for exact ones
+    key_settings = settings
+    if clahe_max_error and volume.dtype == np.uint16:
+        key_settings = dict(settings, clahe_max_error=clahe_max_error)
+    keys = [None] * len(volume)
+    todo = []
+    for index, dst_path in enumerate(slice_dsts):
+        keys[index], cached = fetch_cached(volume[index], key_settings, dst_path)
+        if not cached:
+            todo.append(index)
+
+    for first in range(0, len(todo), SERIES_CHUNK):
+        chunk = todo[first:first + SERIES_CHUNK]
+        colored = colorize_volume(volume[chunk], workers=1, clahe_max_error=clahe_max_error,
+                                  **settings)
+        for index, result in zip(chunk, colored):
+            error = save_image(result, slice_dsts[index])
+            if error:
+                return 0, 0.0, time.perf_counter() - start, error, 0
+            store_cached(keys[index], slice_dsts[index])
+    return (len(volume), volume.size / 1e6, time.perf_counter() - start, None,
+            len(volume) - len(todo))
+
+
+def run_batch(input_dir, output_dir, settings, workers=None, overwrite=False,
+              output_format="same", window=(None, None), profile=False, dtype=np.uint8,
+              cache_dir=None, cache_bytes=RESULT_CACHE_BYTES, clahe_max_error=None):
+    """Colorize every image under input_dir into the same layout under output_dir.
+
+    DICOM files are read one series (directory) at a time and windowed with
+    window=(center, width), defaulting to each series' own window. Images
+    are decoded and windowed as dtype, uint8 or uint16. With profile,
+    per-stage timings and memory are collected from the workers and reported
+    at the end. With a cache_dir, results are looked up in and added to a
+    ResultCache there, capped at cache_bytes. clahe_max_error is passed on to
+    process_series.
+    """
+    jobs = []
+    skipped = 0
+    for rel_path in find_images(input_dir):
+        src_path = os.path.join(input_dir, rel_path)
+        dst_path = output_path(output_dir, rel_path, output_format)
+        if not overwrite and is_up_to_date(src_path, dst_path):
+            skipped += 1
+            continue
+        jobs.append((rel_path, process_file, (src_path, dst_path, settings, dtype)))
+
+    for rel_paths in find_dicom_series(input_dir):
+        src_paths = [os.path.join(input_dir, rel_path) for rel_path in rel_paths]
+        dst_paths = [output_path(output_dir, rel_path, output_format) for rel_path in rel_paths]
+        if not overwrite and all(map(is_up_to_date, src_paths, dst_paths)):
+            skipped += len(rel_paths)
+            continue
+        label = f"{os.path.dirname(rel_paths[0]) or '.'} ({len(rel_paths)} DICOM slices)"
+        jobs.append((label, process_series,
+                     (src_paths, dst_paths, settings, window, dtype, clahe_max_error)))
+
+    if cache_dir is not None:
+        # Apply the cap up front, in case it was lowered since the last run
+        ResultCache(cache_dir, cache_bytes).prune()
+
+    processed = failed = from_cache = 0
+    total_mp = 0.0
+    stats = profiling.StageStats()
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             initializer=init_worker,
+                             initargs=(profile, cache_dir, cache_bytes)) as executor:
+        if profile:
+            futures = {executor.submit(run_profiled, func, *args): label
+                       for label, func, args in jobs}
+        else:
+            futures = {executor.submit(func, *args): label for label, func, args in jobs}
+        for future in as_completed(futures):
+            label = futures[future]
+            try:
+                result = future.result()
+                if profile:
+                    result, records = result
+                    stats.extend(records)
+                images, megapixels, seconds, error, cached = result
+            except Exception as exc:
+                images, megapixels, seconds, error, cached = 0, 0.0, 0.0, str(exc), 0
+            if error:
+                failed += 1
+                print(f"FAIL {label}: {error}")
+                continue
+            processed += images
+            from_cache += cached
+            total_mp += megapixels
+            print(f"  ok {label}: {seconds * 1000:.1f} ms, "
+                  f"{megapixels / seconds if seconds else 0.0:.1f} MP/s"
+                  f"{f' ({cached} cached)' if cached else ''}")
+    elapsed = time.perf_counter() - start
+
+    print(f"\n{processed} processed, {skipped} skipped, {failed} failed "
+          f"in {elapsed:.2f} s")
+    if cache_dir is not None:
+        print(f"Result cache: {from_cache} of {processed} from {cache_dir}")
+    if processed and elapsed > 0:
+        print(f"Throughput: {processed / elapsed:.1f} images/s, "
+              f"{total_mp / elapsed:.1f} MP/s")
+    if profile and stats.records:
+        print("\nPer-stage profile (peak memory is traced per worker):")
+        print(stats.report())
+    return failed == 0
+
+
+def add_pipeline_arguments(parser, colormap=True):
+    """Add the modality/colormap flags shared by the command-line tools."""
+    parser.add_argument("--modality", choices=list(MODALITY_SUBTYPES), default="MRI")
+    parser.add_argument("--subtype", default=None,
+                        help="MRI: 1.5T/3T, X-ray: standard/highres, "
+                             "CT: standard/highres/lowdose")
+    if colormap:
+        parser.add_argument("--colormap", default="crystal")
+    parser.add_argument("--gamma", type=float, default=1.0)
+    parser.add_argument("--blend", type=float, default=0.3)
+    parser.add_argument("--no-enhance", dest="enhance", action="store_false",
+                        help="disable CLAHE on the standard subtypes")
+
+
+def pipeline_settings_from_args(parser, args):
+    """Validate the shared flags and return them as colorize() keyword arguments.
+
+    Without a --colormap flag, colormap_name is left out.
+    """
+    subtype = args.subtype or MODALITY_SUBTYPES[args.modality][0]
+    if subtype not in MODALITY_SUBTYPES[args.modality]:
+        parser.error(f"subtype for {args.modality} must be one of "
+                     f"{', '.join(MODALITY_SUBTYPES[args.modality])}")
+    if not args.gamma >= 0:
+        parser.error("--gamma must be a non-negative number")
+    settings = {
+        "modality": args.modality,
+        "subtype": subtype,
+        "gamma": args.gamma,
+        "blend_factor": args.blend,
+        "enhance": args.enhance,
+    }
+    if hasattr(args, "colormap"):
+        settings["colormap_name"] = args.colormap
+    return settings
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Colorize a directory tree of medical images without the GUI.")
+    parser.add_argument("input_dir", nargs="?", default="input",
+                        help="directory to read images from (default: input)")
+    parser.add_argument("output_dir", nargs="?", default="output",
+                        help="directory to write results to (default: output)")
+    add_pipeline_arguments(parser)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="reprocess files whose output is already up to date")
+    parser.add_argument("--window-center", type=float, default=None,
+                        help="DICOM window centre (default: from each series)")
+    parser.add_argument("--window-width", type=float, default=None,
+                        help="DICOM window width (default: from each series)")
+    parser.add_argument("--output-format", choices=("same", "npy"), default="same",
+                        help="'npy' writes memory-mapped arrays instead of encoded "
+                             "images (.npy inputs always produce .npy)")
+    parser.add_argument("--bit-depth", type=int, choices=(8, 16), default=8,
+                        help="decode and window images at 8 or 16 bits; 16 keeps the "
+                             "range of 12/16-bit MRI and CT (default: %(default)s)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="reuse results of identical inputs and settings from this "
+                             "directory, adding new ones to it")
+    parser.add_argument("--cache-size", type=float, default=RESULT_CACHE_BYTES / 2**30,
+                        help="cache size cap in GB; least recently used results are "
+                             "evicted (default: %(default)s)")
+    parser.add_argument("--clahe-max-error", type=int, default=None,
+                        help="16-bit DICOM series: run CLAHE slice after slice, reusing "
+                             "tile tables while results stay within this many 16-bit "
+                             "levels of the exact ones (0 keeps them exact)")
+    parser.add_argument("--profile", action="store_true",
+                        help="report per-stage timings (p50/p95) and peak memory")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    settings = pipeline_settings_from_args(parser, args)
+    if not os.path.isdir(args.input_dir):
+        parser.error(f"input directory not found: {args.input_dir}")
+    if args.clahe_max_error is not None and args.clahe_max_error < 0:
+        parser.error("--clahe-max-error must not be negative")
+
+    ok = run_batch(args.input_dir, args.output_dir, settings,
+                   workers=args.workers, overwrite=args.overwrite,
+                   output_format=args.output_format,
+                   window=(args.window_center, args.window_width),
+                   profile=args.profile,
+                   dtype=np.uint16 if args.bit_depth == 16 else np.uint8,
+                   cache_dir=args.cache_dir, cache_bytes=int(args.cache_size * 2**30),
+                   clahe_max_error=args.clahe_max_error)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
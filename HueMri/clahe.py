@@ -0,0 +1,489 @@
+"""Block-wise CLAHE that reproduces cv2.CLAHE exactly.
+
+OpenCV computes one clipped-histogram lookup table per tile of an 8x8 grid
+and bilinearly interpolates the four nearest tables for every pixel. Split
+into its two halves, the same computation can stream over an image of any
+size: tile histograms are accumulated block by block, turned into lookup
+tables, and each output block is interpolated independently. Results are
+seam-free because every block sees the same global tables.
+
+The same split runs on a thread pool (apply_clahe with an executor): bands of
+whole tile rows build their histograms and tables independently, and bands
+of BAND_ROWS rows are then interpolated from the shared tables, so band
+edges blend the neighbouring tile rows exactly as a single pass would.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+# Rows interpolated per task when CLAHE is split across threads
+BAND_ROWS = 64
+
+ClaheGeometry = namedtuple(
+    'ClaheGeometry',
+    'height width tiles_y tiles_x tile_height tile_width hist_size')
+
+
+def clahe_geometry(shape, tile_grid_size=(8, 8), dtype=np.uint8):
+    """Tile layout cv2.CLAHE uses for an image of the given (height, width) and dtype.
+
+    tile_grid_size is (tiles_x, tiles_y), as for cv2.createCLAHE.
+    """
+    height, width = shape[:2]
+    tiles_x, tiles_y = tile_grid_size
+    padded_height, padded_width = height, width
+    if height % tiles_y or width % tiles_x:
+        # OpenCV pads the bottom/right edge whenever either axis is off the
+        # grid, adding a whole extra grid step to an axis that was already on it
+        padded_height += tiles_y - height % tiles_y
+        padded_width += tiles_x - width % tiles_x
+    hist_size = 65536 if np.dtype(dtype) == np.uint16 else 256
+    return ClaheGeometry(height, width, tiles_y, tiles_x,
+                         padded_height // tiles_y, padded_width // tiles_x, hist_size)
+
+
+def _reflect_101(index, size):
+    # Index map of cv2.BORDER_REFLECT_101 past the end of an axis. Padding
+    # can be longer than a short axis, so the reflection repeats with period
+    # 2 * (size - 1), as in cv2.borderInterpolate; a single pixel repeats
+    if size == 1:
+        return np.zeros_like(index)
+    period = 2 * (size - 1)
+    index = index % period
+    return np.where(index < size, index, period - index)
+
+
+def read_padded(image, geometry, y0, y1, x0, x1):
+    """Read rows [y0, y1) and columns [x0, x1) of the image as OpenCV pads it."""
+    rows = _reflect_101(np.arange(y0, y1), geometry.height)
+    cols = _reflect_101(np.arange(x0, x1), geometry.width)
+    r0, c0 = rows.min(), cols.min()
+    block = np.asarray(image[r0:rows.max() + 1, c0:cols.max() + 1])
+    if y1 > geometry.height:
+        block = block[rows - r0]
+    if x1 > geometry.width:
+        block = block[:, cols - c0]
+    return block
+
+
+def accumulate_histograms(hist, block, geometry, y0, x0):
+    """Add a block of the padded image at (y0, x0) to the per-tile histograms."""
+    import cv2
+
+    h, w = block.shape
+    y = y0
+    while y < y0 + h:
+        ty = y // geometry.tile_height
+        y_end = min((ty + 1) * geometry.tile_height, y0 + h)
+        x = x0
+        while x < x0 + w:
+            tx = x // geometry.tile_width
+            x_end = min((tx + 1) * geometry.tile_width, x0 + w)
+            piece = block[y - y0:y_end - y0, x - x0:x_end - x0]
+            if piece.size < geometry.hist_size:
+                # calcHist has a fixed cost per bin that dominates small pieces
+                hist[ty, tx] += np.bincount(piece.ravel(), minlength=geometry.hist_size)
+            else:
+                # calcHist counts exactly (below 2**24 per bin) and, unlike
+                # np.bincount, releases the GIL for banded threads
+                counts = cv2.calcHist([piece], [0], None, [geometry.hist_size],
+                                      [0, geometry.hist_size])
+                hist[ty, tx] += counts.reshape(-1).astype(np.int64)
+            x = x_end
+        y = y_end
+    return hist
+
+
+def tile_histograms(image, geometry, block_rows=1024, block_cols=4096):
+    """Histogram of every CLAHE tile, reading the image one bounded block at a time."""
+    hist = np.zeros((geometry.tiles_y, geometry.tiles_x, geometry.hist_size), np.int64)
+    padded_height = geometry.tiles_y * geometry.tile_height
+    padded_width = geometry.tiles_x * geometry.tile_width
+    for y0 in range(0, padded_height, block_rows):
+        y1 = min(y0 + block_rows, padded_height)
+        for x0 in range(0, padded_width, block_cols):
+            x1 = min(x0 + block_cols, padded_width)
+            block = read_padded(image, geometry, y0, y1, x0, x1)
+            accumulate_histograms(hist, block, geometry, y0, x0)
+    return hist
+
+
+def clip_histograms(hist, geometry, clip_limit):
+    """Clip tile histograms at clip_limit and redistribute the excess as OpenCV does."""
+    hist_size = hist.shape[-1]
+    tile_area = geometry.tile_height * geometry.tile_width
+    hist = hist.astype(np.int64, copy=True)
+    if clip_limit <= 0.0:
+        return hist
+
+    limit = max(int(clip_limit * tile_area / hist_size), 1)
+    clipped = np.maximum(hist - limit, 0).sum(axis=-1)
+    np.minimum(hist, limit, out=hist)
+
+    redist_batch = clipped // hist_size
+    residual = clipped - redist_batch * hist_size
+    hist += redist_batch[..., np.newaxis]
+
+    # The remainder goes one count at a time to evenly spaced bins
+    step = np.maximum(hist_size // np.maximum(residual, 1), 1)[..., np.newaxis]
+    bins = np.arange(hist_size)
+    hist += (bins % step == 0) & (bins // step < residual[..., np.newaxis])
+    return hist
+
+
+def clahe_luts(hist, geometry, clip_limit):
+    """Clip and redistribute tile histograms into (tiles_y, tiles_x, hist_size) lookup tables."""
+    hist_size = geometry.hist_size
+    tile_area = geometry.tile_height * geometry.tile_width
+    hist = clip_histograms(hist, geometry, clip_limit)
+
+    lut_scale = np.float32(hist_size - 1) / np.float32(tile_area)
+    scaled = np.cumsum(hist, axis=-1).astype(np.float32) * lut_scale
+    dtype = np.uint16 if hist_size > 256 else np.uint8
+    return np.clip(np.rint(scaled), 0, hist_size - 1).astype(dtype)
+
+
+def present_levels(hist):
+    """Gray levels that occur in any tile of the histograms."""
+    levels = np.flatnonzero(hist.reshape(-1, hist.shape[-1]).any(axis=0))
+    return levels if levels.size else np.zeros(1, np.intp)
+
+
+def coarse_clahe_luts(hist, geometry, clip_limit, bins=256, present=None):
+    """16-bit lookup tables from histograms clipped at `bins` levels, as 8-bit CLAHE clips them.
+
+    Clipping all 65536 bins caps bins that each hold a sliver of an 8-bit
+    bin's count, so on continuous 16-bit data almost nothing is clipped and
+    noise is amplified. Here the clipping and redistribution happen on the
+    coarse bins, and each coarse bin's clipped count is spread over its fine
+    levels in proportion to their own counts, keeping the 16-bit ordering.
+    Entries are only computed for the levels present in the image, which is
+    all interpolate() looks up: 12-bit data has at most 4096 of them even
+    when windowed across the full 16-bit range. Tables computed for a subset
+    of the tiles line up with the others when given the same present levels.
+    """
+    width = geometry.hist_size // bins
+    total = hist.reshape(hist.shape[:-1] + (bins, width)).sum(axis=-1)
+
+    if present is None:
+        present = present_levels(hist)
+    dense = present.size > geometry.hist_size // 4
+    if dense:
+        present = np.arange(geometry.hist_size)
+    within = coarse_table_values(hist if dense else hist[..., present], present, total,
+                                 geometry, clip_limit)
+    if dense:
+        return within.astype(np.uint16)
+
+    luts = np.zeros(hist.shape[:-1] + (present[-1] + 1,), np.uint16)
+    luts[..., present] = within
+    return luts
+
+
+def coarse_table_values(counts, levels, total, geometry, clip_limit):
+    """coarse_clahe_luts entries at the given levels, as float32.
+
+    counts holds each tile's count at those levels, which must include
+    every level the tile has pixels at, and total its coarse histogram.
+    """
+    bins = total.shape[-1]
+    width = geometry.hist_size // bins
+    coarse = clip_histograms(total, geometry, clip_limit)
+    bin_of = levels // width
+    # Per-bin values are expanded to the levels present with np.repeat, which
+    # is much cheaper than fancy indexing
+    runs = np.bincount(bin_of, minlength=bins)
+
+    def expand(per_bin):
+        return np.repeat(per_bin.astype(np.float32), runs, axis=-1)
+
+    # Count within its coarse bin up to each level; exact in float32 for
+    # tiles under 2**24 pixels
+    within = np.cumsum(counts, axis=-1, dtype=np.float32)
+    within -= expand(np.cumsum(total, axis=-1) - total)
+    # A tile with no counts in a coarse bin still receives redistributed
+    # counts there; spread those evenly over the bin's levels
+    empty = total == 0
+    if empty.any():
+        position = (levels - bin_of * width + 1).astype(np.float32)
+        within += expand(empty) * position
+
+    # level = scale * (count of the coarse bins below + this bin's share)
+    scale = (geometry.hist_size - 1) / (geometry.tile_height * geometry.tile_width)
+    within *= expand(scale * coarse / np.where(empty, width, total))
+    within += expand(scale * (np.cumsum(coarse, axis=-1) - coarse))
+    np.rint(within, out=within)
+    np.minimum(within, geometry.hist_size - 1, out=within)
+    return within
+
+
+def _axis_weights(start, stop, tile_size, tiles):
+    # Neighbouring tile indices and interpolation weights along one axis
+    pos = np.arange(start, stop, dtype=np.float32) * (np.float32(1.0) / np.float32(tile_size))
+    pos -= np.float32(0.5)
+    first = np.floor(pos)
+    weight = (pos - first).astype(np.float32)
+    first = first.astype(np.intp)
+    return (np.maximum(first, 0), np.minimum(first + 1, tiles - 1),
+            weight, np.float32(1.0) - weight)
+
+
+def _runs(first, second):
+    # Split an axis into runs of positions that share the same pair of tiles
+    change = np.flatnonzero((np.diff(first) != 0) | (np.diff(second) != 0)) + 1
+    bounds = np.concatenate(([0], change, [len(first)]))
+    return zip(bounds[:-1], bounds[1:])
+
+
+def interpolate(block, luts, geometry, y0=0, x0=0, out=None):
+    """Map a block at (y0, x0) of the original image through the interpolated tile tables.
+
+    luts may already be converted to float32, which saves converting them
+    again for every block.
+    """
+    h, w = block.shape
+    ty1, ty2, ya, ya1 = _axis_weights(y0, y0 + h, geometry.tile_height, geometry.tiles_y)
+    tx1, tx2, xa, xa1 = _axis_weights(x0, x0 + w, geometry.tile_width, geometry.tiles_x)
+    if out is None:
+        out = np.empty((h, w), np.uint16 if geometry.hist_size > 256 else np.uint8)
+    top_limit = np.float32(geometry.hist_size - 1)
+    tables = luts.astype(np.float32, copy=False)
+
+    # Each region between tile centres blends the same four tables, which
+    # are small enough to gather from directly
+    for r0, r1 in _runs(ty1, ty2):
+        wy, wy1 = ya[r0:r1, np.newaxis], ya1[r0:r1, np.newaxis]
+        for c0, c1 in _runs(tx1, tx2):
+            wx, wx1 = xa[c0:c1], xa1[c0:c1]
+            values = block[r0:r1, c0:c1]
+            top = (np.take(tables[ty1[r0], tx1[c0]], values) * wx1
+                   + np.take(tables[ty1[r0], tx2[c0]], values) * wx)
+            bottom = (np.take(tables[ty2[r0], tx1[c0]], values) * wx1
+                      + np.take(tables[ty2[r0], tx2[c0]], values) * wx)
+            top *= wy1
+            bottom *= wy
+            top += bottom
+            np.rint(top, out=top)
+            np.clip(top, 0, top_limit, out=top)
+            out[r0:r1, c0:c1] = top
+    return out
+
+
+def _tile_luts(hist, geometry, clip_limit, coarse_clip, present=None):
+    if coarse_clip and geometry.hist_size > 256:
+        return coarse_clahe_luts(hist, geometry, clip_limit, present=present)
+    return clahe_luts(hist, geometry, clip_limit)
+
+
+def apply_clahe(image, clip_limit, tile_grid_size=(8, 8), block_rows=1024, out=None,
+                coarse_clip=False, executor=None):
+    """CLAHE of a 2D uint8/uint16 array-like, processed in row blocks; matches cv2.CLAHE.
+
+    With coarse_clip, a uint16 image is clipped at 256 levels instead (see
+    coarse_clahe_luts), which no longer matches OpenCV. With an executor
+    (a thread pool), the image is processed in bands on it; the result is
+    the same.
+    """
+    geometry = clahe_geometry(image.shape, tile_grid_size, image.dtype)
+    if out is None:
+        out = np.empty(image.shape[:2], image.dtype)
+    if executor is not None:
+        return _banded_clahe(image, geometry, clip_limit, coarse_clip, executor, out)
+
+    hist = tile_histograms(image, geometry, block_rows)
+    luts = _tile_luts(hist, geometry, clip_limit, coarse_clip)
+    for y0 in range(0, geometry.height, block_rows):
+        y1 = min(y0 + block_rows, geometry.height)
+        interpolate(np.asarray(image[y0:y1]), luts, geometry, y0, 0, out=out[y0:y1])
+    return out
+
+
+def _banded_clahe(image, geometry, clip_limit, coarse_clip, executor, out):
+    # Histograms, clipping and tables are per tile, so bands of tile rows are
+    # independent; NumPy and OpenCV release the GIL in the heavy calls
+    hist = np.zeros((geometry.tiles_y, geometry.tiles_x, geometry.hist_size), np.int64)
+    padded_width = geometry.tiles_x * geometry.tile_width
+
+    def histogram_band(ty):
+        y0 = ty * geometry.tile_height
+        block = read_padded(image, geometry, y0, y0 + geometry.tile_height, 0, padded_width)
+        accumulate_histograms(hist, block, geometry, y0, 0)
+
+    list(executor.map(histogram_band, range(geometry.tiles_y)))
+
+    # Coarse tables only cover the levels in the image, which every band must agree on
+    present = present_levels(hist) if coarse_clip else None
+
+    def table_band(ty):
+        luts = _tile_luts(hist[ty:ty + 1], geometry, clip_limit, coarse_clip, present)
+        return luts.astype(np.float32)
+
+    tables = np.concatenate(list(executor.map(table_band, range(geometry.tiles_y))))
+
+    def interpolate_band(y0):
+        y1 = min(y0 + BAND_ROWS, geometry.height)
+        interpolate(np.asarray(image[y0:y1]), tables, geometry, y0, 0, out=out[y0:y1])
+
+    list(executor.map(interpolate_band, range(0, geometry.height, BAND_ROWS)))
+    return out
+
+
+class IncrementalCLAHE:
+    """16-bit CLAHE over a sequence of similar images, reusing tables from the images before.
+
+    Meant for neighbouring slices of a stack or frames of a cine loop. A
+    tile keeps the lookup table it already has while the table of its new
+    histogram provably lies within max_error - 1 levels of it; blending the
+    tables adds at most one level of rounding, so every result is within
+    max_error levels of apply_clahe(image, clip_limit, coarse_clip=True).
+    Tables are checked against the histogram they were built from, so error
+    does not build up along the sequence. With max_error=0 only tiles whose
+    histogram is unchanged keep their table, and the result is exact.
+
+    Histograms and tables only cover the levels the sequence has used so
+    far, a few thousand for 12-bit data, instead of all 65536. Only uint16
+    images are accepted: for 8-bit images cv2.CLAHE does the whole pass
+    faster than the tables alone could be checked here.
+    """
+
+    def __init__(self, clip_limit, tile_grid_size=(8, 8), max_error=0, executor=None):
+        self.clip_limit = clip_limit
+        self.tile_grid_size = tile_grid_size
+        self.max_error = max_error
+        self.executor = executor
+        self.tables_reused = 0
+        self.tables_computed = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the previous images, e.g. before an unrelated sequence."""
+        self.geometry = None
+        self._levels = None
+        self._covered = None
+        self._bin_starts = self._bins_used = None
+        # Per tile: the level counts, coarse histogram and clipped coarse
+        # histogram its table was built from
+        self._counts = None
+        self._total = None
+        self._coarse = None
+        self._tables = None
+
+    def apply(self, image, out=None):
+        """CLAHE of the next 2D uint16 image of the sequence."""
+        import cv2
+
+        if image.dtype != np.uint16 or image.ndim != 2:
+            raise ValueError("incremental CLAHE expects 2D uint16 images")
+        g = clahe_geometry(image.shape, self.tile_grid_size, image.dtype)
+        if g != self.geometry:
+            self.reset()
+            self.geometry = g
+        if out is None:
+            out = np.empty(image.shape, np.uint16)
+
+        padded = read_padded(image, g, 0, g.tiles_y * g.tile_height, 0, g.tiles_x * g.tile_width)
+        levels = cv2.calcHist([np.ascontiguousarray(padded)], [0], None, [g.hist_size],
+                              [0, g.hist_size])
+        self._update_levels(np.flatnonzero(levels.reshape(-1)))
+
+        # Pixels as their index among the covered levels, counted per tile
+        index = np.zeros(g.hist_size, np.uint16)
+        index[self._levels] = np.arange(self._levels.size)
+        compact = np.take(index, padded)
+        counts = np.zeros((g.tiles_y, g.tiles_x, self._levels.size), np.int64)
+        compact_geometry = g._replace(hist_size=self._levels.size)
+
+        def count_row(ty):
+            y0 = ty * g.tile_height
+            accumulate_histograms(counts, compact[y0:y0 + g.tile_height], compact_geometry, y0, 0)
+
+        self._map(count_row, range(g.tiles_y))
+        self._update_tables(counts.reshape(g.tiles_y * g.tiles_x, -1))
+
+        tables = self._tables.reshape(g.tiles_y, g.tiles_x, -1)
+
+        def interpolate_band(y0):
+            y1 = min(y0 + BAND_ROWS, g.height)
+            interpolate(compact[y0:y1, :g.width], tables, g, y0, 0, out=out[y0:y1])
+
+        self._map(interpolate_band, range(0, g.height, BAND_ROWS))
+        return out
+
+    def _map(self, func, items):
+        if self.executor is None:
+            for item in items:
+                func(item)
+        else:
+            list(self.executor.map(func, items))
+
+    def _update_levels(self, present):
+        if self._levels is not None and self._covered[present].all():
+            return
+        if self._levels is None:
+            self._covered = np.zeros(self.geometry.hist_size, bool)
+        self._covered[present] = True
+        levels = np.flatnonzero(self._covered)
+        if self._levels is None or levels.size > 2 * present.size:
+            # Start over rather than let the covered levels keep growing
+            self._counts = self._total = self._coarse = self._tables = None
+            self._covered[...] = False
+            self._covered[present] = True
+            levels = present
+        else:
+            # Kept tables are rebuilt at the new levels from their own counts
+            counts = np.zeros((self._counts.shape[0], levels.size), np.int64)
+            counts[:, np.searchsorted(levels, self._levels)] = self._counts
+            self._counts = counts
+            self._tables = None
+        self._levels = levels
+        # Where each coarse bin's levels start among the covered levels
+        bin_of = levels // (self.geometry.hist_size // 256)
+        self._bin_starts = np.searchsorted(bin_of, np.arange(256))
+        self._bins_used = np.unique(bin_of)
+
+    def _bin_sums(self, values):
+        # Per-level values summed over each coarse bin of 256 levels
+        sums = np.zeros((values.shape[0], 256), np.int64)
+        sums[:, self._bins_used] = np.add.reduceat(values, self._bin_starts[self._bins_used],
+                                                   axis=-1)
+        return sums
+
+    def _table_bound(self, counts, total, coarse):
+        # Largest change, in output levels, between each tile's table and the
+        # one its current histogram gives. Level v in coarse bin b maps to
+        # scale * (clipped count below b + clipped count of b * share of b's
+        # pixels up to v); the first two terms are compared exactly, and a
+        # share moves by at most twice the bin's histogram distance over its count
+        g = self.geometry
+        below = np.cumsum(coarse, axis=-1) - coarse
+        kept_below = np.cumsum(self._coarse, axis=-1) - self._coarse
+        distance = self._bin_sums(np.abs(counts - self._counts))
+        share = np.minimum(2 * distance / np.maximum(np.maximum(total, self._total), 1), 1.0)
+        bound = (np.abs(below - kept_below) + np.abs(coarse - self._coarse)
+                 + np.maximum(coarse, self._coarse) * share).max(axis=-1)
+        scale = (g.hist_size - 1) / (g.tile_height * g.tile_width)
+        # One level more for rounding the entries, unless nothing changed
+        return np.where(bound > 0, scale * bound + 1, 0)
+
+    def _update_tables(self, counts):
+        g = self.geometry
+        total = self._bin_sums(counts)
+        coarse = clip_histograms(total, g, self.clip_limit)
+        if self._counts is None:
+            self._counts, self._total, self._coarse = counts, total, coarse
+            reuse = np.zeros(counts.shape[0], bool)
+        else:
+            reuse = self._table_bound(counts, total, coarse) <= max(self.max_error - 1, 0)
+            self._counts[~reuse] = counts[~reuse]
+            self._total[~reuse] = total[~reuse]
+            self._coarse[~reuse] = coarse[~reuse]
+
+        compute = ~reuse
+        if self._tables is None:
+            self._tables = np.empty(counts.shape, np.float32)
+            compute[...] = True
+        if compute.any():
+            self._tables[compute] = coarse_table_values(
+                self._counts[compute], self._levels, self._total[compute], g, self.clip_limit)
+        self.tables_reused += int(np.count_nonzero(reuse))
+        self.tables_computed += int(np.count_nonzero(~reuse))
@@ -0,0 +1,194 @@
+"""Precomputed colormap tables, so colorizing never has to import matplotlib.
+
+colormaps.npz holds the colormaps the application offers (every name in
+engine.MODALITY_COLORMAPS that matplotlib knows, and the custom 'crystal'
+and 'medical' maps), each as the (N, 3) RGB colors the map quantizes to.
+Table maps sample them exactly as matplotlib's colormaps do, so every table
+built from them is bit-identical to one built from matplotlib. The colors
+stay float64 because that exactness needs it: 8-bit tables truncate
+color * 255, and none of the stored colors survives a round trip through
+float32.
+
+A reversed map, '<name>_r', is the stored colors in reverse order, which is
+how matplotlib reverses listed maps; its segment-based maps sample the
+reversed curve instead, which can differ by one gray level in some entries.
+Any other name falls back to matplotlib itself.
+
+The file is regenerated, and checked against matplotlib, with:
+
+    python colormaps.py
+"""
+import os
+import sys
+import threading
+
+import numpy as np
+
+COLORMAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'colormaps.npz')
+
+CUSTOM_COLORMAPS = {
+    'medical': [
+        (0, 0, 0.3),      # Dark blue for low values
+        (0, 0.5, 0.8),    # Blue
+        (0, 0.8, 0.8),    # Cyan
+        (0.2, 0.8, 0.2),  # Green
+        (0.8, 0.8, 0),    # Yellow
+        (0.8, 0.4, 0),    # Orange
+        (0.8, 0, 0),      # Red for high values
+    ],
+    # Enhanced colormap for better detail visibility
+    'crystal': [
+        (0.0, 0.0, 0.0),        # Pure black for background
+        (0.1, 0.1, 0.3),        # Dark blue for low intensity
+        (0.2, 0.4, 0.8),        # Bright blue for soft tissues
+        (0.4, 0.8, 0.9),        # Cyan for enhanced soft tissue contrast
+        (0.6, 0.9, 0.6),        # Light green for medium intensity
+        (0.8, 0.9, 0.4),        # Yellow for bone structures
+        (0.9, 0.7, 0.2),        # Orange for enhanced bone details
+        (1.0, 0.5, 0.0),        # Red for high intensity areas
+        (1.0, 1.0, 1.0),        # White for maximum intensity
+    ],
+}
+
+REVERSED_SUFFIX = '_r'
+
+_names = None
+_colors = {}
+_lock = threading.Lock()
+
+
+class TableColormap:
+    """A colormap sampled from its stored colors the way a matplotlib colormap is.
+
+    Calling it maps values in [0, 1] to (len(values), 4) RGBA floats: each
+    value picks one of the N colors, values below 0 and above 1 clamp to the
+    first and last color, and NaN maps to transparent black.
+    """
+
+    def __init__(self, name, colors):
+        self.name = name
+        self.colors = colors
+        self.N = len(colors)
+        # N colors, then the under, over and bad colors matplotlib appends
+        lut = np.ones((self.N + 3, 4))
+        lut[:self.N, :3] = colors
+        lut[self.N] = lut[0]
+        lut[self.N + 1] = lut[self.N - 1]
+        lut[self.N + 2] = 0.0
+        self._lut = lut
+
+    def __call__(self, values):
+        index = np.array(values, dtype=np.float64, ndmin=1) * self.N
+        index[index == self.N] = self.N - 1
+        under, over, bad = index < 0, index >= self.N, np.isnan(index)
+        with np.errstate(invalid='ignore'):
+            index = index.astype(np.intp)
+        index[under] = self.N
+        index[over] = self.N + 1
+        index[bad] = self.N + 2
+        return self._lut.take(index, axis=0)
+
+    def __repr__(self):
+        return f"TableColormap({self.name!r}, N={self.N})"
+
+
+def _table_names():
+    global _names
+    with _lock:
+        if _names is None:
+            try:
+                with np.load(COLORMAP_FILE) as archive:
+                    _names = frozenset(archive.files)
+            except FileNotFoundError:
+                _names = frozenset()
+    return _names
+
+
+def colormap_names():
+    """Names of every colormap in the table file, and of their reversed maps."""
+    names = _table_names()
+    return sorted(names | {name + REVERSED_SUFFIX for name in names})
+
+
+def load_colormap(name):
+    """The named colormap, from the table file when it has it, else from matplotlib.
+
+    Raises KeyError for a name neither knows.
+    """
+    names = _table_names()
+    if name in names:
+        return TableColormap(name, _stored_colors(name))
+    base = name[:-len(REVERSED_SUFFIX)]
+    if name.endswith(REVERSED_SUFFIX) and base in names:
+        return TableColormap(name, _stored_colors(base)[::-1])
+    try:
+        return matplotlib_colormap(name)
+    except ImportError:
+        raise KeyError(f"unknown colormap: {name}") from None
+
+
+def _stored_colors(name):
+    with _lock:
+        colors = _colors.get(name)
+        if colors is None:
+            # Only the requested map is decompressed
+            with np.load(COLORMAP_FILE) as archive:
+                colors = _colors[name] = archive[name]
+    return colors
+
+
+def matplotlib_colormap(name):
+    """The named colormap built by matplotlib itself."""
+    if name in CUSTOM_COLORMAPS:
+        from matplotlib.colors import LinearSegmentedColormap
+        return LinearSegmentedColormap.from_list(name, CUSTOM_COLORMAPS[name])
+    # The colormap registry does not pull in pyplot or a GUI backend
+    import matplotlib
+    return matplotlib.colormaps[name]
+
+
+def build_tables():
+    """{name: (N, 3) colors} of every colormap the application offers."""
+    from engine import MODALITY_COLORMAPS
+
+    offered = {name for names in MODALITY_COLORMAPS.values() for name in names}
+    tables = {}
+    for name in sorted(offered | set(CUSTOM_COLORMAPS)):
+        try:
+            cmap = matplotlib_colormap(name)
+        except KeyError:
+            # Offered, but not a colormap matplotlib has either
+            continue
+        rgba = cmap(np.linspace(0.0, 1.0, cmap.N))
+        if not np.all(rgba[:, 3] == 1.0):
+            # Table maps are opaque; leave translucent maps to matplotlib
+            continue
+        tables[name] = np.ascontiguousarray(rgba[:, :3])
+    return tables
+
+
+def check_tables(tables):
+    """Names whose table colormap samples differently from matplotlib's."""
+    probe = np.concatenate([np.linspace(-0.5, 1.5, 65537), [np.nan, np.inf, -np.inf]])
+    mismatched = []
+    for name, colors in tables.items():
+        if not np.array_equal(TableColormap(name, colors)(probe),
+                              matplotlib_colormap(name)(probe)):
+            mismatched.append(name)
+    return mismatched
+
+
+def main():
+    tables = build_tables()
+    mismatched = check_tables(tables)
+    if mismatched:
+        print(f"table colormaps differ from matplotlib: {', '.join(mismatched)}")
+        return 1
+    np.savez_compressed(COLORMAP_FILE, **tables)
+    print(f"Wrote {len(tables)} colormaps to {COLORMAP_FILE} "
+          f"({os.path.getsize(COLORMAP_FILE) / 1024:.0f} KiB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Compare one image under several colormaps.
+
+    python compare.py slice.png out_dir --modality CT --colormaps crystal,bone,hot
+
+All colormaps are rendered in one pass with engine.colorize_variants(), so
+CLAHE runs once however many are compared. The variants are written
+concurrently as <name>_<colormap>.png, next to a labelled comparison sheet.
+"""
+import os
+import sys
+import math
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from engine import MODALITY_COLORMAPS, colorize_variants, get_colormap
+
+SHEET_LABEL_HEIGHT = 28
+SHEET_BACKGROUND = (32, 32, 32)
+
+
+def default_colormaps(modality):
+    """The colormaps offered for a modality that can actually be built."""
+    names = []
+    for name in MODALITY_COLORMAPS.get(modality, MODALITY_COLORMAPS["CT"]):
+        try:
+            get_colormap(name)
+        except (KeyError, ValueError):
+            continue
+        names.append(name)
+    return names
+
+
+def comparison_sheet(variants, names, columns=None, cell_size=None):
+    """Tile a (K, H, W, 3) stack into one BGR image with each variant labelled by name.
+
+    cell_size caps the longest edge of every variant, shrinking them with
+    area averaging.
+    """
+    count, height, width = variants.shape[:3]
+    columns = columns or math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+    scale = min(cell_size / max(height, width), 1.0) if cell_size else 1.0
+    cell_w, cell_h = max(int(width * scale), 1), max(int(height * scale), 1)
+
+    sheet = np.empty((rows * (cell_h + SHEET_LABEL_HEIGHT), columns * cell_w, 3), np.uint8)
+    sheet[...] = SHEET_BACKGROUND
+    for k, (variant, name) in enumerate(zip(variants, names)):
+        y0 = (k // columns) * (cell_h + SHEET_LABEL_HEIGHT)
+        x0 = (k % columns) * cell_w
+        cv2.putText(sheet, name, (x0 + 8, y0 + SHEET_LABEL_HEIGHT - 9),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1, cv2.LINE_AA)
+        cell = sheet[y0 + SHEET_LABEL_HEIGHT:y0 + SHEET_LABEL_HEIGHT + cell_h, x0:x0 + cell_w]
+        if scale < 1.0:
+            cv2.resize(variant, (cell_w, cell_h), dst=cell, interpolation=cv2.INTER_AREA)
+        else:
+            cell[...] = variant
+    return sheet
+
+
+def save_variants(variants, names, output_dir, stem, ext='.png', workers=None):
+    """Write every variant as <stem>_<name><ext> concurrently. Returns the paths written."""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = [os.path.join(output_dir, f"{stem}_{name}{ext}") for name in names]
+
+    def write(k):
+        if not cv2.imwrite(paths[k], variants[k]):
+            raise ValueError(f"could not write image: {paths[k]}")
+
+    # OpenCV encodes without the GIL, so the files compress in parallel
+    with ThreadPoolExecutor(max_workers=workers or min(len(names), os.cpu_count())) as executor:
+        list(executor.map(write, range(len(names))))
+    return paths
+
+
+def main(argv=None):
+    from batch import add_pipeline_arguments, pipeline_settings_from_args
+    from loaders import load_image
+
+    parser = argparse.ArgumentParser(
+        description="Render one image under several colormaps and a comparison sheet.")
+    parser.add_argument("image", help="input image (PNG, TIFF, DICOM, .npy, ...)")
+    parser.add_argument("output_dir", help="directory to write the variants to")
+    add_pipeline_arguments(parser, colormap=False)
+    parser.add_argument("--colormaps", default=None,
+                        help="comma-separated colormaps (default: all offered for the modality)")
+    parser.add_argument("--bit-depth", type=int, choices=(8, 16), default=8,
+                        help="decode and process at 8 or 16 bits (default: %(default)s)")
+    parser.add_argument("--sheet-cell", type=int, default=512,
+                        help="longest edge of each variant on the sheet (default: %(default)s)")
+    parser.add_argument("--no-sheet", dest="sheet", action="store_false",
+                        help="only write the individual variants")
+    args = parser.parse_args(argv)
+    settings = pipeline_settings_from_args(parser, args)
+
+    names = (args.colormaps.split(',') if args.colormaps
+             else default_colormaps(settings["modality"]))
+    try:
+        image = load_image(args.image, np.uint16 if args.bit_depth == 16 else np.uint8)
+    except ValueError as exc:
+        parser.error(str(exc))
+    if image.ndim != 2:
+        parser.error("expected a single 2D image")
+
+    start = time.perf_counter()
+    variants = colorize_variants(image, names, **settings)
+    stem = os.path.splitext(os.path.basename(args.image))[0]
+    paths = save_variants(variants, names, args.output_dir, stem)
+    if args.sheet:
+        sheet_path = os.path.join(args.output_dir, f"{stem}_sheet.png")
+        if not cv2.imwrite(sheet_path, comparison_sheet(variants, names,
+                                                        cell_size=args.sheet_cell)):
+            parser.error(f"could not write {sheet_path}")
+        paths.append(sheet_path)
+    elapsed = time.perf_counter() - start
+    print(f"{len(names)} colormaps in {elapsed:.2f} s")
+    for path in paths:
+        print(f"  {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,585 @@
+"""GUI-free colorization engine.
+
+Only numpy is imported at module load, and OpenCV on first use, so that
+worker processes and services that import the engine start quickly.
+The offered colormaps come from the precomputed tables in colormaps.npz
+and the gamma curves are computed directly, so neither matplotlib nor
+scikit-image is needed to colorize with them (see colormaps.py).
+
+Every stage keeps the input's integer dtype, uint8 or uint16, and only the
+final colormap lookup produces 8-bit BGR; floating point only appears while
+building the 256- or 65536-entry tables. A call allocates a fixed set of
+full-frame buffers: the CLAHE output and the BGR result (or just the result
+when out is given), plus, for the crystal map, its gamma-mapped and CLAHE
+planes and one uint16 index plane (8-bit) or gray plane (16-bit).
+"""
+import os
+import functools
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from colormaps import load_colormap
+from profiling import stage
+
+# Inputs are 8- or 16-bit grayscale, so per-pixel maps reduce to tables
+# with one entry per gray level
+GRAY_LEVELS = np.arange(256, dtype=np.uint8)
+GRAY_LEVELS_16 = np.arange(65536, dtype=np.uint16)
+
+# Subtypes offered per modality; the first is the default
+MODALITY_SUBTYPES = {
+    "MRI": ("1.5T", "3T"),
+    "X-ray": ("standard", "highres"),
+    "CT": ("standard", "highres", "lowdose"),
+}
+
+# Colormaps offered per modality
+MODALITY_COLORMAPS = {
+    "MRI": ('crystal', 'medical', 'bone', 'cool', 'viridis', 'plasma'),
+    "X-ray": ('crystal', 'bone', 'gray', 'hot', 'copper'),
+    "CT": ('crystal', 'bone', 'gray', 'hot', 'copper', 'bone_enhanced'),
+}
+
+# Subtypes that always enhance contrast: (clip limit, gamma scale)
+SUBTYPE_PRESETS = {
+    ("MRI", "3T"): (0.05, 0.9),
+    ("X-ray", "highres"): (0.03, 0.7),
+    ("CT", "highres"): (0.04, 0.8),
+    ("CT", "lowdose"): (0.06, 1.2),
+}
+
+# Clip limit of the standard subtypes when contrast enhancement is enabled
+STANDARD_CLIP_LIMITS = {"MRI": 0.03, "X-ray": 0.02, "CT": 0.03}
+
+# The crystal colormap runs its own CLAHE pass with this clip limit
+CRYSTAL_CLIP_LIMIT = 0.05
+
+# Colormap instances and lookup tables, built once per colormap name and depth
+_colormaps = {}
+_colormap_luts = {}
+
+# cv2.CLAHE objects keep per-call state and must not be shared between
+# threads, so each thread keeps its own cache
+_thread_local = threading.local()
+
+# Threads one CLAHE pass may use; see set_num_threads()
+_clahe_threads = os.cpu_count() or 1
+_band_executor = None
+_band_lock = threading.Lock()
+
+# Pixels per np.take call in gather(), bounding its intp index copy
+GATHER_CHUNK = 1 << 14
+
+# Default byte budget of a StageCache
+STAGE_CACHE_BYTES = 512 * 2**20
+
+# Stands in for a stage result that is the input array itself
+_SAME_INPUT = object()
+
+
+class StageCache:
+    """Intermediate results of the expensive pipeline stages, bounded by a byte budget.
+
+    Entries are keyed by the identity of the input array and the parameters
+    the stage depends on, and the least recently used ones are evicted
+    first. Inputs are assumed not to change in place while cached; entries
+    of an input are dropped when the array is garbage collected.
+    """
+
+    def __init__(self, max_bytes=STAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._inputs = {}
+        self._lock = threading.Lock()
+
+    def get(self, image, key, compute, *args):
+        """Return the cached result of stage key for image, calling compute(*args) on a miss."""
+        full_key = (id(image),) + key
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                self._entries.move_to_end(full_key)
+                self.hits += 1
+                return tuple(image if part is _SAME_INPUT else part for part in entry[0])
+            self.misses += 1
+
+        value = compute(*args)
+        # A stage may pass its input through unchanged; that is not ours to count or freeze
+        arrays = [part for part in value if isinstance(part, np.ndarray) and part is not image]
+        size = sum(array.nbytes for array in arrays)
+        if size > self.max_bytes:
+            return value
+        for array in arrays:
+            _read_only(array)
+
+        with self._lock:
+            if id(image) not in self._inputs:
+                self._inputs[id(image)] = weakref.ref(image, functools.partial(self._forget, id(image)))
+            if full_key not in self._entries:
+                # Holding the input itself would keep it alive forever
+                stored = tuple(_SAME_INPUT if part is image else part for part in value)
+                self._entries[full_key] = (stored, size)
+                self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_size
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._inputs.clear()
+            self.nbytes = 0
+
+    def _forget(self, image_id, ref=None):
+        # The input was garbage collected and its id may be reused
+        with self._lock:
+            self._inputs.pop(image_id, None)
+            for key in [key for key in self._entries if key[0] == image_id]:
+                self.nbytes -= self._entries.pop(key)[1]
+
+
+def colorize(image, modality="MRI", subtype="1.5T", colormap_name="crystal",
+             gamma=1.0, blend_factor=0.3, enhance=True, out=None, cache=None):
+    """Run the modality-specific pipeline on a grayscale image and return an 8-bit BGR image.
+
+    image may be any 2D uint8 or uint16 array, including a read-only
+    np.memmap; 16-bit images keep their full range until the colormap. If out
+    is given (an (H, W, 3) uint8 array such as a memmap), the result is
+    written into it and out is returned. With a StageCache, the CLAHE stages
+    are reused across calls on the same image, so changing only the gamma,
+    colormap or blend costs a table lookup.
+    """
+    if image.dtype not in (np.uint8, np.uint16):
+        raise ValueError(f"expected an 8- or 16-bit grayscale image, got {image.dtype}")
+    clip_limit, gamma = pipeline_settings(modality, subtype, gamma, enhance)
+    if cache is None:
+        if clip_limit is not None:
+            image = enhance_contrast(image, clip_limit=clip_limit)
+        return apply_tone_map(image, colormap_name, gamma, blend_factor, out=out)
+
+    enhanced = image
+    if clip_limit is not None:
+        enhanced, = cache.get(image, ('clahe', clip_limit), _enhance_stage, image, clip_limit)
+    if colormap_name != 'crystal':
+        return apply_tone_map(enhanced, colormap_name, gamma, blend_factor, out=out)
+    toned, crystal, lo, hi = cache.get(image, ('crystal', clip_limit, gamma),
+                                       crystal_stage, enhanced, gamma)
+    return apply_crystal_tables(toned, crystal, lo, hi, blend_factor, out=out)
+
+
+def colorize_variants(image, colormap_names, modality="MRI", subtype="1.5T", gamma=1.0,
+                      blend_factor=0.3, enhance=True, out=None, cache=None):
+    """Render one image under several colormaps as a (K, H, W, 3) uint8 BGR stack.
+
+    Variant k matches colorize() with colormap_names[k]. CLAHE runs once for
+    all of them (the crystal map's own pass once more), and the colormaps
+    are one stacked (K, 2**bits, 3) table gathered on the engine's thread
+    pool. out may be a preallocated (K, H, W, 3) array; cache a StageCache.
+    """
+    if image.dtype not in (np.uint8, np.uint16):
+        raise ValueError(f"expected an 8- or 16-bit grayscale image, got {image.dtype}")
+    names = tuple(colormap_names)
+    if out is None:
+        out = np.empty((len(names),) + image.shape + (3,), np.uint8)
+    clip_limit, gamma = pipeline_settings(modality, subtype, gamma, enhance)
+    enhanced = image
+    if clip_limit is not None:
+        if cache is None:
+            enhanced = enhance_contrast(image, clip_limit=clip_limit)
+        else:
+            enhanced, = cache.get(image, ('clahe', clip_limit), _enhance_stage,
+                                  image, clip_limit)
+
+    if 'crystal' in names:
+        # The crystal pass runs here so that only table lookups go to the pool
+        if cache is None:
+            crystal = crystal_stage(enhanced, gamma)
+        else:
+            crystal = cache.get(image, ('crystal', clip_limit, gamma),
+                                crystal_stage, enhanced, gamma)
+    other = tuple(name for name in names if name != 'crystal')
+    tables = stacked_tone_lut(other, gamma, blend_factor, image.dtype.itemsize * 8)
+
+    def render(k):
+        if names[k] == 'crystal':
+            apply_crystal_tables(*crystal, blend_factor, out=out[k])
+        else:
+            gather(tables[other.index(names[k])], enhanced, out[k])
+
+    with stage('tone_map_variants', enhanced) as record:
+        executor = band_executor()
+        if executor is None or len(names) < 2:
+            for k in range(len(names)):
+                render(k)
+        else:
+            list(executor.map(render, range(len(names))))
+        record.output(out)
+    return out
+
+
+def _enhance_stage(image, clip_limit):
+    return (enhance_contrast(image, clip_limit=clip_limit),)
+
+
+def pipeline_settings(modality, subtype, gamma=1.0, enhance=True):
+    """Return the (clip_limit, gamma) a modality/subtype applies; a None clip limit skips CLAHE.
+
+    Raises ValueError for a negative gamma.
+    """
+    check_gamma(gamma)
+    if modality not in STANDARD_CLIP_LIMITS:
+        modality = "CT"
+    preset = SUBTYPE_PRESETS.get((modality, subtype))
+    if preset is None:
+        return (STANDARD_CLIP_LIMITS[modality] if enhance else None), gamma
+    clip_limit, gamma_scale = preset
+    return clip_limit, (gamma * gamma_scale if gamma != 1.0 else 1.0)
+
+
+def get_clahe(clip_limit, tile_grid_size=(8, 8)):
+    """Return this thread's CLAHE object for (clip_limit, tile_grid_size)."""
+    cache = getattr(_thread_local, 'clahe', None)
+    if cache is None:
+        cache = _thread_local.clahe = {}
+    key = (clip_limit, tuple(tile_grid_size))
+    clahe = cache.get(key)
+    if clahe is None:
+        import cv2
+
+        clahe = cache[key] = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=key[1])
+    return clahe
+
+
+def set_num_threads(threads):
+    """Set how many threads one CLAHE pass may use; worker processes should use 1.
+
+    8-bit images go through OpenCV, whose CLAHE already splits the tile
+    tables and the interpolated rows over its own thread pool; 16-bit images
+    are split into bands on a shared pool of this size (see clahe.py).
+    """
+    import cv2
+
+    global _clahe_threads, _band_executor
+    cv2.setNumThreads(threads)
+    with _band_lock:
+        _clahe_threads = max(threads, 1)
+        if _band_executor is not None:
+            _band_executor.shutdown(wait=False)
+            _band_executor = None
+
+
+def band_executor():
+    """The engine's shared thread pool, or None when limited to one thread.
+
+    16-bit CLAHE bands and colormap variants run on it.
+    """
+    global _band_executor
+    with _band_lock:
+        if _clahe_threads <= 1:
+            return None
+        if _band_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            _band_executor = ThreadPoolExecutor(_clahe_threads, thread_name_prefix='engine')
+        return _band_executor
+
+
+def equalize(image, clip_limit, out=None, parallel=True):
+    """CLAHE of a uint8 or uint16 image, with clip limits on the 8-bit pipeline's scale.
+
+    Callers that already run one image per thread pass parallel=False to
+    keep 16-bit images on their own thread.
+    """
+    if image.dtype == np.uint16:
+        from clahe import apply_clahe
+
+        # OpenCV clips each of the 65536 histogram bins, which leaves
+        # continuous 16-bit data almost unclipped (and bunches the clipped
+        # remainder into the low bins); clipping at 256 levels keeps the
+        # enhancement of the 8-bit pipeline at 16-bit precision
+        return apply_clahe(image, clip_limit, out=out, coarse_clip=True,
+                           executor=band_executor() if parallel else None)
+
+    clahe = get_clahe(clip_limit)
+    if out is None:
+        return clahe.apply(np.asarray(image))
+    return _into(out, clahe.apply(np.asarray(image), _cv_dst(out)))
+
+
+def enhance_contrast(image, clip_limit=0.03, out=None):
+    """CLAHE of a uint8 or uint16 image, written into out (an (H, W) array of its dtype) if given."""
+    with stage('clahe', image) as record:
+        # uint8 -> float -> uint8 is the identity, so CLAHE reads the input as is
+        out = equalize(image, clip_limit, out)
+        record.output(out)
+    return out
+
+
+def get_colormap(colormap_name):
+    cmap = _colormaps.get(colormap_name)
+    if cmap is None:
+        cmap = _colormaps[colormap_name] = load_colormap(colormap_name)
+    return cmap
+
+
+def gray_levels(bits=8):
+    """Every gray level of an 8- or 16-bit image, in order."""
+    return GRAY_LEVELS if bits == 8 else GRAY_LEVELS_16
+
+
+def unit_levels(bits=8):
+    """Every gray level of an 8- or 16-bit image scaled to [0, 1] as float64."""
+    # Scaling by the reciprocal matches skimage's img_as_float() bit for bit
+    return gray_levels(bits) * (1.0 / (2**bits - 1))
+
+
+def colormap_lut(cmap, levels):
+    # Sample the colormap once per gray level instead of once per pixel
+    colored = cmap(levels)
+    return np.ascontiguousarray((colored[:, 2::-1] * 255).astype(np.uint8))
+
+
+def interpolated_colormap_lut(cmap, levels):
+    # Matplotlib colormaps hold cmap.N colors and quantize to them; 16-bit
+    # levels interpolate linearly between those colors instead, which
+    # reproduces the 8-bit table exactly at the levels an 8-bit image has
+    colors = cmap(np.linspace(0.0, 1.0, cmap.N))
+    positions = np.clip(levels, 0.0, 1.0) * (cmap.N - 1)
+    table = np.empty((len(levels), 3), np.uint8)
+    for channel in range(3):
+        table[:, 2 - channel] = np.interp(positions, np.arange(cmap.N), colors[:, channel]) * 255
+    return table
+
+
+def get_colormap_lut(colormap_name, bits=8):
+    # (2**bits)x3 uint8 BGR table, compiled once per colormap name and depth
+    lut = _colormap_luts.get((colormap_name, bits))
+    if lut is None:
+        levels = unit_levels(bits)
+        if bits == 8:
+            lut = colormap_lut(get_colormap(colormap_name), levels)
+        else:
+            lut = interpolated_colormap_lut(get_colormap(colormap_name), levels)
+        _colormap_luts[colormap_name, bits] = lut
+    return lut
+
+
+def check_gamma(gamma):
+    """Raise ValueError unless gamma is a non-negative number, as skimage's adjust_gamma() does."""
+    if not gamma >= 0:
+        raise ValueError("gamma should be a non-negative real number")
+
+
+@functools.lru_cache(maxsize=64)
+def gamma_lut(gamma, bits=8):
+    """Table of the gamma curve with one entry per gray level, in the image's dtype."""
+    check_gamma(gamma)
+    # The rounding of skimage's adjust_gamma(): 8-bit levels round to
+    # nearest, 16-bit levels truncate
+    if bits == 8:
+        curve = unit_levels(bits) ** gamma
+        return _read_only(np.minimum(np.rint(curve * 255), 255).astype(np.uint8))
+    curve = (GRAY_LEVELS_16 / 65535.0) ** gamma
+    return _read_only((curve * 65535.0).astype(np.uint16))
+
+
+@functools.lru_cache(maxsize=256)
+def crystal_lut(lo, hi, bits=8):
+    """Crystal colormap table for an image whose gray levels span [lo, hi]."""
+    # The crystal map brightens with a 0.8 gamma and stretches the image's
+    # own range to [0, 1]; both are per-level maps folded into the table
+    levels = unit_levels(bits) ** 0.8
+    levels = (levels - levels[lo]) / (levels[hi] - levels[lo])
+    if bits == 8:
+        return _read_only(colormap_lut(get_colormap('crystal'), levels))
+    return _read_only(interpolated_colormap_lut(get_colormap('crystal'), levels))
+
+
+@functools.lru_cache(maxsize=64)
+def tone_lut(colormap_name, gamma=1.0, blend_factor=0.0, bits=8):
+    """(2**bits)x3 BGR table fusing gamma, colormap and blend for one gray level each."""
+    gray = gamma_lut(gamma, bits) if gamma != 1.0 else gray_levels(bits)
+    table = gather(get_colormap_lut(colormap_name, bits), gray)
+    if blend_factor > 0:
+        table = blend_with_original(to_8bit(gray)[:, np.newaxis], table[:, np.newaxis],
+                                    blend_factor)[:, 0]
+    return _read_only(table)
+
+
+@functools.lru_cache(maxsize=16)
+def stacked_tone_lut(colormap_names, gamma=1.0, blend_factor=0.0, bits=8):
+    """(K, 2**bits, 3) stack of the tone_lut() of every name in a tuple of colormap names."""
+    if not colormap_names:
+        return _read_only(np.empty((0, 2**bits, 3), np.uint8))
+    return _read_only(np.stack([tone_lut(name, gamma, blend_factor, bits)
+                                for name in colormap_names]))
+
+
+@functools.lru_cache(maxsize=64)
+def crystal_blend_lut(lo, hi, blend_factor):
+    """(256*256)x3 table blending gray level p with the crystal color of level c at p*256+c."""
+    gray = np.repeat(GRAY_LEVELS, 256).reshape(256, 256)
+    colors = np.broadcast_to(crystal_lut(lo, hi), (256, 256, 3))
+    table = blend_with_original(gray, np.ascontiguousarray(colors), blend_factor)
+    return _read_only(table.reshape(-1, 3))
+
+
+def apply_tone_map(image, colormap_name, gamma=1.0, blend_factor=0.3, out=None):
+    """Apply gamma, colormap and blend to a contrast-enhanced image in a single table lookup."""
+    if colormap_name != 'crystal':
+        with stage('tone_map', image) as record:
+            table = tone_lut(colormap_name, gamma, blend_factor, image.dtype.itemsize * 8)
+            out = gather(table, image, out)
+            record.output(out)
+        return out
+
+    toned, enhanced, lo, hi = crystal_stage(image, gamma)
+    return apply_crystal_tables(toned, enhanced, lo, hi, blend_factor, out=out)
+
+
+def crystal_stage(image, gamma=1.0):
+    """Gamma curve and crystal CLAHE: returns (toned, enhanced, lo, hi) for apply_crystal_tables."""
+    import cv2
+
+    # The crystal map runs its own CLAHE between the gamma curve and the
+    # colormap, so the gray levels before and after it index the table jointly
+    with stage('crystal_clahe', image) as record:
+        if gamma == 1.0:
+            toned = image
+        elif image.dtype == np.uint8:
+            toned = cv2.LUT(image, gamma_lut(gamma))
+        else:
+            toned = gather(gamma_lut(gamma, 16), image)
+        enhanced = equalize(toned, CRYSTAL_CLIP_LIMIT)
+        lo, hi = (int(v) for v in cv2.minMaxLoc(enhanced)[:2])
+        record.output(toned, enhanced)
+    return toned, enhanced, lo, hi
+
+
+def apply_crystal_tables(toned, enhanced, lo, hi, blend_factor, out=None):
+    """Color the crystal CLAHE output and blend it with the gray image it was computed from.
+
+    lo and hi are the gray range of the whole enhanced image, which may be
+    larger than the block passed in.
+    """
+    with stage('crystal_tone_map', toned, enhanced) as record:
+        if toned.dtype == np.uint16:
+            # A joint (toned, enhanced) table would need 2**32 entries, so
+            # 16-bit images are colored first and blended afterwards
+            out = gather(crystal_lut(lo, hi, 16), enhanced, out)
+            if blend_factor > 0:
+                blend_gray_into(to_8bit(toned), out, blend_factor)
+        elif blend_factor <= 0:
+            out = gather(crystal_lut(lo, hi), enhanced, out)
+        else:
+            index = np.left_shift(toned, 8, dtype=np.uint16)
+            np.bitwise_or(index, enhanced, out=index)
+            out = gather(crystal_blend_lut(lo, hi, blend_factor), index, out)
+        record.output(out)
+    return out
+
+
+def gather(table, index, out=None):
+    """Look up table rows for every pixel of index, optionally into a preallocated out."""
+    if out is None:
+        out = np.empty(index.shape + table.shape[1:], table.dtype)
+    # np.take converts the index to intp, so gather in chunks of rows to keep
+    # that copy small; mode='clip' lets it write straight into out
+    flat_index = index.reshape(-1, index.shape[-1]) if index.ndim > 1 else index[np.newaxis]
+    flat_out = out.view()
+    try:
+        flat_out.shape = flat_index.shape + table.shape[1:]
+    except AttributeError:
+        # An out that cannot be viewed as rows is filled in one call
+        return np.take(table, index, axis=0, out=out, mode='clip')
+    step = max(GATHER_CHUNK // max(flat_index.shape[1], 1), 1)
+    if table.shape[1:] == (3,) and table.dtype == np.uint8 and flat_index.size:
+        _gather_bgr(table, flat_index, flat_out, step)
+        return out
+    for start in range(0, flat_index.shape[0], step):
+        np.take(table, flat_index[start:start + step], axis=0,
+                out=flat_out[start:start + step], mode='clip')
+    return out
+
+
+def _gather_bgr(table, flat_index, flat_out, step):
+    import cv2
+
+    # Gathering 3-byte rows is slow; gathering the table padded to one
+    # 4-byte word per entry and dropping the padding with OpenCV is about
+    # twice as fast, through a chunk-sized scratch buffer
+    padded = np.zeros((len(table), 4), np.uint8)
+    padded[:, :3] = table
+    words = padded.view(np.uint32)[:, 0]
+    scratch = np.empty((min(step, flat_index.shape[0]), flat_index.shape[1]), np.uint32)
+    for start in range(0, flat_index.shape[0], step):
+        rows = flat_index[start:start + step]
+        packed = scratch[:len(rows)]
+        np.take(words, rows, out=packed, mode='clip')
+        dst = flat_out[start:start + step]
+        bgra = packed.view(np.uint8).reshape(rows.shape + (4,))
+        _into(dst, cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR, dst=_cv_dst(dst)))
+
+
+def _cv_dst(out):
+    # OpenCV can only write into arrays whose rows hold contiguous pixels
+    if out is None or out.dtype != np.uint8 or not out.flags.writeable:
+        return None
+    itemsize = out.shape[2] if out.ndim == 3 else 1
+    if out.strides[-1] != 1 or out.strides[1 if out.ndim == 3 else -1] != itemsize:
+        return None
+    return out
+
+
+def _into(out, result):
+    # A dst OpenCV could not use is filled from its freshly allocated result
+    if not np.shares_memory(out, result):
+        out[...] = result
+    return out
+
+
+def to_8bit(image):
+    """Round a uint16 image to uint8 levels (uint8 images are returned unchanged)."""
+    if image.dtype == np.uint8:
+        return image
+    import cv2
+
+    if image.ndim == 1:
+        return np.rint(image / 257.0).astype(np.uint8)
+    if image.ndim == 3:
+        return np.stack([to_8bit(plane) for plane in image])
+    return cv2.convertScaleAbs(image, alpha=1 / 257)
+
+
+def blend_gray_into(gray, colored, blend_factor):
+    """blend_with_original() writing into colored, for (H, W) images or (N, H, W) stacks."""
+    if colored.ndim == 4:
+        for plane, colored_plane in zip(gray, colored):
+            blend_gray_into(plane, colored_plane, blend_factor)
+        return colored
+    import cv2
+
+    original_3ch = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+    return _into(colored, cv2.addWeighted(original_3ch, blend_factor, colored,
+                                          1.0 - blend_factor, 0, dst=_cv_dst(colored)))
+
+
+def blend_with_original(original, colored, blend_factor=0.3):
+    import cv2
+
+    original_3ch = cv2.cvtColor(original, cv2.COLOR_GRAY2BGR)
+    blended = cv2.addWeighted(original_3ch, blend_factor, colored, 1.0 - blend_factor, 0)
+    return blended
+
+
+def _read_only(array):
+    # Cached tables are shared between callers
+    array.flags.writeable = False
+    return array
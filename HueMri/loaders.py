@@ -0,0 +1,225 @@
+"""Image and array I/O for the engine.
+
+NumPy and raw inputs are memory-mapped rather than read, and outputs can be
+preallocated .npy memmaps that the engine writes into directly, so internal
+pipelines exchange pixels without an encode/decode step.
+"""
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def load_array(path, shape=None, dtype=None, offset=0):
+    """Memory-map a .npy file, or a headerless raw file given its shape and dtype.
+
+    Nothing is copied: the result is a read-only np.memmap (or the .npy
+    equivalent) backed by the file.
+    """
+    if os.path.splitext(path)[1].lower() == '.npy':
+        return np.load(path, mmap_mode='r')
+    if shape is None or dtype is None:
+        raise ValueError(f"shape and dtype are required to map raw file: {path}")
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=tuple(shape))
+
+
+def open_output(path, shape, dtype=np.uint8):
+    """Create a preallocated .npy memmap for the engine to write colorized output into."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+
+
+def load_image(path, dtype=np.uint8):
+    """Read a grayscale image, memory-mapping it when the format allows it.
+
+    Decoded images and DICOM files come back as dtype (uint8, or uint16 to
+    keep 12/16-bit data); memory-mapped .npy and TIFF files keep their own
+    dtype.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        return load_array(path)
+    if ext in DICOM_EXTENSIONS:
+        return load_dicom(path, dtype=dtype)[0]
+    if ext in ('.tif', '.tiff'):
+        import tifffile
+
+        try:
+            image = tifffile.memmap(path, mode='r')
+            if image.ndim == 2:
+                return image
+        except ValueError:
+            # Compressed or tiled files cannot be mapped; decode them below
+            pass
+
+    import cv2
+
+    if np.dtype(dtype) == np.uint16:
+        image = cv2.imread(path, cv2.IMREAD_ANYDEPTH)
+        if image is not None and image.dtype == np.uint8:
+            # 8-bit files span the 16-bit range the same way
+            image = np.multiply(image, 257, dtype=np.uint16)
+    else:
+        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError(f"could not read image: {path}")
+    return image
+
+
+DICOM_EXTENSIONS = ('.dcm',)
+
+DicomSeries = namedtuple('DicomSeries', 'paths volume window_center window_width inverted')
+
+# Decoded series (rescaled to modality units) keyed by their files' paths,
+# sizes and modification times; windowing is cheap and applied per request.
+# Bounded by the bytes of the volumes held, least recently used out first
+_dicom_series_cache = OrderedDict()
+DICOM_SERIES_CACHE_BYTES = 512 * 2**20
+
+
+def _read_dicom(path):
+    import pydicom
+
+    return pydicom.dcmread(path)
+
+
+def _slice_position(dataset):
+    # Order along the scan axis, falling back to the instance number
+    position = getattr(dataset, 'ImagePositionPatient', None)
+    if position is not None and len(position) == 3:
+        return float(position[2])
+    return float(getattr(dataset, 'InstanceNumber', 0) or 0)
+
+
+def _first_value(value):
+    # Window tags may hold several presets; the first is the default
+    if value is None:
+        return None
+    if hasattr(value, '__len__') and not isinstance(value, str):
+        return float(value[0]) if len(value) else None
+    return float(value)
+
+
+def _decode_dicom_series(paths, workers):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        datasets = list(executor.map(_read_dicom, paths))
+    order = sorted(range(len(datasets)), key=lambda i: _slice_position(datasets[i]))
+    datasets = [datasets[i] for i in order]
+    paths = [paths[i] for i in order]
+
+    first = datasets[0]
+    volume = np.empty((len(datasets), first.Rows, first.Columns), np.float32)
+    slopes = np.empty(len(datasets), np.float32)
+    intercepts = np.empty(len(datasets), np.float32)
+    for index, dataset in enumerate(datasets):
+        volume[index] = dataset.pixel_array
+        slopes[index] = float(getattr(dataset, 'RescaleSlope', 1) or 1)
+        intercepts[index] = float(getattr(dataset, 'RescaleIntercept', 0) or 0)
+
+    # Rescale slope/intercept to modality units (Hounsfield for CT) in one pass
+    volume *= slopes[:, np.newaxis, np.newaxis]
+    volume += intercepts[:, np.newaxis, np.newaxis]
+    volume.flags.writeable = False
+
+    return DicomSeries(paths=tuple(paths), volume=volume,
+                       window_center=_first_value(getattr(first, 'WindowCenter', None)),
+                       window_width=_first_value(getattr(first, 'WindowWidth', None)),
+                       inverted=getattr(first, 'PhotometricInterpretation', '') == 'MONOCHROME1')
+
+
+def load_dicom_series(paths, workers=8, cache=True):
+    """Read a DICOM series in one bulk pass and return it as a DicomSeries.
+
+    paths is a directory or a list of .dcm files. Slices are read on a thread
+    pool, sorted along the scan axis, stacked into an (N, H, W) float32
+    volume and rescaled to modality units. Decoded series are cached until
+    one of their files changes; callers that read each series once pass
+    cache=False so it is neither looked up nor kept.
+    """
+    if isinstance(paths, str):
+        if os.path.isdir(paths):
+            paths = sorted(os.path.join(paths, name) for name in os.listdir(paths)
+                           if name.lower().endswith(DICOM_EXTENSIONS))
+        else:
+            paths = [paths]
+    paths = [os.path.abspath(path) for path in paths]
+    if not paths:
+        raise ValueError("no DICOM files found")
+    if not cache:
+        return _decode_dicom_series(paths, workers)
+
+    key = tuple((path, stat.st_size, stat.st_mtime_ns)
+                for path, stat in ((path, os.stat(path)) for path in paths))
+    series = _dicom_series_cache.get(key)
+    if series is not None:
+        _dicom_series_cache.move_to_end(key)
+        return series
+    series = _decode_dicom_series(paths, workers)
+    # A series larger than the whole cache is not kept at all
+    if series.volume.nbytes <= DICOM_SERIES_CACHE_BYTES:
+        _dicom_series_cache[key] = series
+        held = sum(entry.volume.nbytes for entry in _dicom_series_cache.values())
+        while held > DICOM_SERIES_CACHE_BYTES:
+            _, evicted = _dicom_series_cache.popitem(last=False)
+            held -= evicted.volume.nbytes
+    return series
+
+
+def apply_window(volume, center=None, width=None, dtype=np.uint8, inverted=False):
+    """Map modality values to display levels with a DICOM linear window.
+
+    Vectorized over any array shape. Without a center/width the full range
+    of the data is used. dtype may be uint8 or uint16.
+    """
+    top = np.iinfo(dtype).max
+    if center is None or width is None:
+        lo, hi = float(volume.min()), float(volume.max())
+        center, width = (lo + hi) / 2 + 0.5, max(hi - lo, 1.0) + 1
+    width = max(float(width), 1.0)
+
+    # DICOM PS3.3 C.11.2.1.2: ((x - (c - 0.5)) / (w - 1) + 0.5), clipped
+    scale = np.float32(top / max(width - 1, 1.0))
+    levels = np.subtract(volume, np.float32(center - 0.5 - (width - 1) / 2), dtype=np.float32)
+    levels *= scale
+    np.clip(levels, 0, top, out=levels)
+    if inverted:
+        np.subtract(top, levels, out=levels)
+    return np.rint(levels, out=levels).astype(dtype)
+
+
+def window_series(series, center=None, width=None, dtype=np.uint8):
+    """Window a DicomSeries, by default with its own WindowCenter/WindowWidth or full range."""
+    if center is None or width is None:
+        center, width = series.window_center, series.window_width
+    return apply_window(series.volume, center, width, dtype, series.inverted)
+
+
+def load_dicom(paths, center=None, width=None, dtype=np.uint8, workers=8, cache=True):
+    """Read a DICOM file or series and window it to (N, H, W) display levels."""
+    return window_series(load_dicom_series(paths, workers, cache), center, width, dtype)
+
+
+def load_dicom_cine(path, center=None, width=None, dtype=np.uint8):
+    """Read a multi-frame DICOM file (a cine loop) as (N, H, W) display levels.
+
+    Returns (frames, frames per second), the rate being None when the file
+    records neither a frame time nor a cine rate.
+    """
+    dataset = _read_dicom(path)
+    frames = np.asarray(dataset.pixel_array, np.float32)
+    if frames.ndim == 2:
+        frames = frames[np.newaxis]
+    slope = float(getattr(dataset, 'RescaleSlope', 1) or 1)
+    intercept = float(getattr(dataset, 'RescaleIntercept', 0) or 0)
+    if slope != 1 or intercept != 0:
+        frames *= np.float32(slope)
+        frames += np.float32(intercept)
+    if center is None or width is None:
+        center = _first_value(getattr(dataset, 'WindowCenter', None))
+        width = _first_value(getattr(dataset, 'WindowWidth', None))
+    inverted = getattr(dataset, 'PhotometricInterpretation', '') == 'MONOCHROME1'
+
+    frame_time = _first_value(getattr(dataset, 'FrameTime', None))
+    fps = 1000.0 / frame_time if frame_time else _first_value(getattr(dataset, 'CineRate', None))
+    return apply_window(frames, center, width, dtype, inverted), fps
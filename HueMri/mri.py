@@ -1,20 +1,22 @@
 import os
+import sys
 import numpy as np
 import cv2
-from skimage import exposure
-from skimage.util import img_as_float, img_as_ubyte
-import matplotlib.pyplot as plt
-from matplotlib.colors import LinearSegmentedColormap
-import warnings
 import tkinter as tk
 from tkinter import filedialog, ttk
 from PIL import Image, ImageTk
 from tkinter import font as tkfont
+import shutil
+import tempfile
 import webbrowser
 from tkinter import messagebox
+from concurrent.futures import ThreadPoolExecutor
 
-# Suppress specific warnings
-warnings.filterwarnings("ignore", category=UserWarning, module="skimage")
+import profiling
+from compare import comparison_sheet, default_colormaps
+from engine import MODALITY_COLORMAPS, StageCache, colorize, colorize_variants, to_8bit
+from loaders import load_image
+from pyramid import Pyramid, array_blocks, write_pyramid
 
 class MedicalImageColorizer:
     def __init__(self, root):
@@ -54,8 +56,13 @@ class MedicalImageColorizer:
         self.button_font = tkfont.Font(family="Helvetica", size=12, weight="bold")
         
         # Variables
+        self.image_path = None
         self.input_image = None
+        # Bumped on every load (including a reload at another bit depth), so
+        # a render records which input it was made from
+        self.input_version = 0
         self.processed_image = None
+        self.processed_input = None
         self.colormap_var = tk.StringVar(value="crystal")
         self.blend_var = tk.DoubleVar(value=0.3)
         self.gamma_var = tk.DoubleVar(value=1.0)
@@ -63,6 +70,33 @@ class MedicalImageColorizer:
         self.mri_type_var = tk.StringVar(value="1.5T")
         self.modality_var = tk.StringVar(value="MRI")
         self.ct_type_var = tk.StringVar(value="standard")  # New variable for CT type
+        self.high_bit_depth_var = tk.BooleanVar(value=False)
+        
+        # Background processing: one worker, and only the newest job counts
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.job = None
+        self.job_id = 0
+        
+        # Live preview: settings changes re-render a preview-sized proxy of
+        # the input on its own worker, debounced so slider drags coalesce
+        self.preview_proxy = None
+        self.preview_executor = ThreadPoolExecutor(max_workers=1)
+        self.preview_job = None
+        self.preview_id = 0
+        self.preview_after = None
+        self.live_preview_var = tk.BooleanVar(value=True)
+        self.processed_settings = None
+        
+        # Tile pyramid of the last full-resolution result, for the zoom viewer
+        self.pyramid_dir = None
+        self.pyramid_settings = None
+        self.pyramid_input = None
+        self.zoom_viewer = None
+        
+        # CLAHE results of the current image and its proxy, so tweaks to
+        # gamma, colormap or blend skip the contrast enhancement
+        self.stage_cache = StageCache()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         # Configure styles
         self.configure_styles()
@@ -343,12 +377,55 @@ class MedicalImageColorizer:
                        variable=self.enhance_var, 
                        style='Medical.TCheckbutton').pack(anchor=tk.W, pady=5)
         
+        ttk.Checkbutton(gamma_frame,
+                       text="16-bit Processing (12/16-bit MRI and CT)",
+                       variable=self.high_bit_depth_var,
+                       command=self.load_selected_image,
+                       style='Medical.TCheckbutton').pack(anchor=tk.W, pady=5)
+        
         # Process button with modern styling
         process_button = ttk.Button(self.control_frame, 
                                   text="Process Image", 
                                   command=self.process_image,
                                   style='Medical.TButton')
-        process_button.grid(row=5, column=0, columnspan=2, pady=20, sticky=tk.EW)
+        process_button.grid(row=5, column=0, pady=(20, 5), sticky=tk.EW)
+        
+        export_button = ttk.Button(self.control_frame,
+                                 text="Export...",
+                                 command=self.export_image,
+                                 style='Medical.TButton')
+        export_button.grid(row=5, column=1, padx=(10, 0), pady=(20, 5), sticky=tk.EW)
+        
+        ttk.Button(self.control_frame,
+                  text="Zoom Viewer...",
+                  command=self.open_zoom_viewer,
+                  style='Medical.TButton').grid(row=9, column=0, columnspan=2,
+                                                sticky=tk.EW, pady=5)
+        
+        ttk.Button(self.control_frame,
+                  text="Compare Colormaps...",
+                  command=self.compare_colormaps,
+                  style='Medical.TButton').grid(row=10, column=0, columnspan=2,
+                                                sticky=tk.EW, pady=5)
+        
+        ttk.Checkbutton(self.control_frame,
+                       text="Live Preview",
+                       variable=self.live_preview_var,
+                       style='Medical.TCheckbutton').grid(row=8, column=0, columnspan=2,
+                                                          sticky=tk.W, pady=5)
+        
+        # Busy indicator and cancel button, shown while a job is running
+        self.progress = ttk.Progressbar(self.control_frame, mode='indeterminate')
+        self.progress.grid(row=6, column=0, sticky=tk.EW, pady=5)
+        self.cancel_button = ttk.Button(self.control_frame,
+                                      text="Cancel",
+                                      command=self.cancel_processing,
+                                      style='Medical.TButton')
+        self.cancel_button.grid(row=6, column=1, padx=(10, 0), pady=5)
+        self.status_label = ttk.Label(self.control_frame, text="", font=self.label_font)
+        self.status_label.grid(row=7, column=0, columnspan=2, sticky=tk.W)
+        self.progress.grid_remove()
+        self.cancel_button.grid_remove()
         
         # Right panel for image display with modern styling
         self.image_frame = ttk.LabelFrame(scrollable_frame, 
@@ -398,6 +475,11 @@ class MedicalImageColorizer:
         
         # Initialize modality-specific options
         self.update_modality_options()
+        
+        # Changing a setting while a job runs restarts it with the new settings
+        for var in (self.modality_var, self.mri_type_var, self.ct_type_var, self.colormap_var,
+                    self.gamma_var, self.blend_var, self.enhance_var):
+            var.trace_add("write", self.on_settings_changed)
     
     def update_modality_options(self):
         # Show/hide modality-specific frames
@@ -426,14 +508,12 @@ class MedicalImageColorizer:
             widget.destroy()
         
         # Add modality-specific colormaps
+        colormaps = MODALITY_COLORMAPS[self.modality_var.get()]
         if self.modality_var.get() == "MRI":
-            colormaps = ['crystal', 'medical', 'bone', 'cool', 'viridis', 'plasma']
             description = "Crystal: Enhanced detail visibility for nerves and soft tissues"
         elif self.modality_var.get() == "X-ray":
-            colormaps = ['crystal', 'bone', 'gray', 'hot', 'copper']
             description = "Crystal: Enhanced detail visibility for bones and structures"
         else:  # CT
-            colormaps = ['crystal', 'bone', 'gray', 'hot', 'copper', 'bone_enhanced']
             description = "Crystal: Enhanced detail visibility for soft tissues and bones"
         
         for cmap in colormaps:
@@ -452,163 +532,392 @@ class MedicalImageColorizer:
             filetypes=[("Medical Images", "*.png *.jpg *.jpeg *.tif *.tiff *.dcm")]
         )
         if file_path:
-            self.input_image = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
-            if self.input_image is not None:
-                self.display_image(self.input_image, self.original_label, "Original")
+            self.image_path = file_path
+            self.load_selected_image()
+    
+    def load_selected_image(self):
+        if self.image_path is None:
+            return
+        dtype = np.uint16 if self.high_bit_depth_var.get() else np.uint8
+        try:
+            self.input_image = load_image(self.image_path, dtype)
+        except (ValueError, ImportError) as exc:
+            messagebox.showerror("HueSAR", f"Could not open image:\n{exc}")
+            return
+        self.input_version += 1
+        # A render still running belongs to the previous input
+        if self.job is not None:
+            self.cancel_processing()
+        self.preview_proxy = preview_proxy(self.input_image)
+        self.processed_image = None
+        self.processed_settings = None
+        self.processed_input = None
+        self.remove_pyramid()
+        self.display_image(self.preview_proxy, self.original_label, "Original")
+        self.schedule_preview()
     
     def display_image(self, image, label, title):
-        if len(image.shape) == 2:  # Grayscale
-            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-        else:
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        height, width = image.shape[:2]
-        max_size = 500  # Increased size for better visibility
-        if width > height:
-            new_width = max_size
-            new_height = int(height * (max_size / width))
-        else:
-            new_height = max_size
-            new_width = int(width * (max_size / height))
-        
-        image = cv2.resize(image, (new_width, new_height))
-        image = Image.fromarray(image)
-        photo = ImageTk.PhotoImage(image=image)
-        
+        self.show_preview(preview_rgb(image), label)
+    
+    def show_preview(self, rgb, label):
+        photo = ImageTk.PhotoImage(image=Image.fromarray(rgb))
         label.configure(image=photo)
         label.image = photo
     
+    def current_settings(self):
+        modality = self.modality_var.get()
+        subtype = self.ct_type_var.get() if modality == "CT" else self.mri_type_var.get()
+        return dict(modality=modality,
+                    subtype=subtype,
+                    colormap_name=self.colormap_var.get(),
+                    gamma=self.gamma_var.get(),
+                    blend_factor=self.blend_var.get(),
+                    enhance=self.enhance_var.get())
+    
     def process_image(self):
         if self.input_image is None:
             return
+        self.start_job(run_job, self.input_image, self.current_settings())
+    
+    def export_image(self):
+        if self.input_image is None:
+            return
+        path = filedialog.asksaveasfilename(
+            defaultextension=".png",
+            filetypes=[("PNG", "*.png"), ("TIFF", "*.tif *.tiff"), ("JPEG", "*.jpg *.jpeg")]
+        )
+        if not path:
+            return
+        settings = self.current_settings()
+        if self.render_is_current(settings):
+            # The last full-resolution render is still current; just write it
+            self.start_job(run_save, self.processed_image, settings, path)
+        else:
+            self.start_job(run_job, self.input_image, settings, path)
+    
+    def open_zoom_viewer(self):
+        if self.input_image is None:
+            return
+        settings = self.current_settings()
+        if self.pyramid_input == self.input_version and self.pyramid_settings == settings:
+            self.show_pyramid(self.pyramid_dir, settings, self.pyramid_input)
+            return
+        self.remove_pyramid()
+        path = tempfile.mkdtemp(prefix="huesar-pyramid-")
+        if self.render_is_current(settings):
+            self.start_job(run_pyramid_save, self.processed_image, settings, path,
+                           on_done=self.show_pyramid)
+        else:
+            self.start_job(run_pyramid, self.input_image, settings, path,
+                           on_done=self.show_pyramid)
+    
+    def render_is_current(self, settings):
+        """Whether the last full-resolution render is of the loaded input with these settings."""
+        return (self.processed_image is not None
+                and self.processed_input == self.input_version
+                and self.processed_settings == settings)
+    
+    def show_pyramid(self, path, settings, source):
+        self.pyramid_dir = path
+        self.pyramid_settings = settings
+        self.pyramid_input = source
+        self.close_zoom_viewer()
+        self.zoom_viewer = ZoomViewer(self.root, Pyramid(path), self.image_path)
+    
+    def close_zoom_viewer(self):
+        if self.zoom_viewer is not None and self.zoom_viewer.window.winfo_exists():
+            self.zoom_viewer.window.destroy()
+        self.zoom_viewer = None
+    
+    def remove_pyramid(self):
+        # The viewer reads tiles from the directory as it pans
+        self.close_zoom_viewer()
+        if self.pyramid_dir is not None:
+            shutil.rmtree(self.pyramid_dir, ignore_errors=True)
+        self.pyramid_dir = None
+        self.pyramid_settings = None
+        self.pyramid_input = None
+    
+    def compare_colormaps(self):
+        if self.preview_proxy is None:
+            return
+        # Every colormap of the modality at preview resolution, sharing one
+        # CLAHE pass; runs alongside the live preview on its worker
+        settings = self.current_settings()
+        settings.pop("colormap_name")
+        names = default_colormaps(settings["modality"])
+        job = self.preview_executor.submit(run_comparison, self.preview_proxy, names,
+                                           dict(settings, cache=self.stage_cache))
+        self.status_label.configure(text="Comparing colormaps...")
+        self.root.after(20, self.poll_comparison, job)
+    
+    def poll_comparison(self, job):
+        if not job.done():
+            self.root.after(20, self.poll_comparison, job)
+            return
+        try:
+            sheet = job.result()
+        except Exception as exc:
+            self.status_label.configure(text=f"Comparison failed: {exc}")
+            return
+        self.status_label.configure(text="")
+        window = tk.Toplevel(self.root)
+        window.title(f"HueSAR - Colormaps - {os.path.basename(self.image_path)}"
+                     if self.image_path else "HueSAR - Colormaps")
+        photo = ImageTk.PhotoImage(Image.fromarray(sheet))
+        label = tk.Label(window, image=photo, bg="black")
+        label.image = photo
+        label.pack(fill=tk.BOTH, expand=True)
+    
+    def start_job(self, func, image, settings, path=None, on_done=None):
+        # Supersede any earlier job: a queued one never starts, and the
+        # result of a running one is dropped when it arrives
+        if self.job is not None:
+            self.job.cancel()
+        self.job_id += 1
+        self.job = self.executor.submit(func, image, dict(settings, cache=self.stage_cache), path)
+        self.set_busy(True, "Processing..." if path is None or on_done else "Exporting...")
+        self.root.after(50, self.poll_job, self.job, self.job_id, self.input_version,
+                        settings, path, on_done)
+    
+    def poll_job(self, job, job_id, source, settings, path, on_done=None):
+        if job_id != self.job_id:
+            if on_done is not None:
+                shutil.rmtree(path, ignore_errors=True)
+            return
+        if not job.done():
+            self.root.after(50, self.poll_job, job, job_id, source, settings, path, on_done)
+            return
         
-        # Apply modality-specific processing
-        if self.modality_var.get() == "MRI":
-            # MRI processing
-            if self.mri_type_var.get() == "3T":
-                processed_image = self.enhance_contrast(self.input_image, clip_limit=0.05)
-                if self.gamma_var.get() != 1.0:
-                    processed_image = self.apply_gamma_correction(processed_image, self.gamma_var.get() * 0.9)
-            else:
-                if self.enhance_var.get():
-                    processed_image = self.enhance_contrast(self.input_image)
-                else:
-                    processed_image = self.input_image
-                
-                if self.gamma_var.get() != 1.0:
-                    processed_image = self.apply_gamma_correction(processed_image, self.gamma_var.get())
-        elif self.modality_var.get() == "X-ray":
-            # X-ray processing
-            if self.mri_type_var.get() == "highres":
-                processed_image = self.enhance_contrast(self.input_image, clip_limit=0.03)
-                if self.gamma_var.get() != 1.0:
-                    processed_image = self.apply_gamma_correction(processed_image, self.gamma_var.get() * 0.7)
-            else:
-                if self.enhance_var.get():
-                    processed_image = self.enhance_contrast(self.input_image, clip_limit=0.02)
-                else:
-                    processed_image = self.input_image
-                
-                if self.gamma_var.get() != 1.0:
-                    processed_image = self.apply_gamma_correction(processed_image, self.gamma_var.get())
-        else:  # CT processing
-            if self.ct_type_var.get() == "highres":
-                processed_image = self.enhance_contrast(self.input_image, clip_limit=0.04)
-                if self.gamma_var.get() != 1.0:
-                    processed_image = self.apply_gamma_correction(processed_image, self.gamma_var.get() * 0.8)
-            elif self.ct_type_var.get() == "lowdose":
-                processed_image = self.enhance_contrast(self.input_image, clip_limit=0.06)
-                if self.gamma_var.get() != 1.0:
-                    processed_image = self.apply_gamma_correction(processed_image, self.gamma_var.get() * 1.2)
-            else:  # standard
-                if self.enhance_var.get():
-                    processed_image = self.enhance_contrast(self.input_image, clip_limit=0.03)
-                else:
-                    processed_image = self.input_image
-                
-                if self.gamma_var.get() != 1.0:
-                    processed_image = self.apply_gamma_correction(processed_image, self.gamma_var.get())
-        
-        # Apply colormap
-        colored_image = self.apply_colormap(processed_image, self.colormap_var.get())
-        
-        # Blend with original
-        if self.blend_var.get() > 0:
-            final_image = self.blend_with_original(processed_image, colored_image, self.blend_var.get())
+        # Tk is not thread-safe, so results are picked up here on the main loop
+        self.job = None
+        try:
+            self.processed_image, rgb = job.result()
+        except Exception as exc:
+            self.set_busy(False)
+            if on_done is not None:
+                shutil.rmtree(path, ignore_errors=True)
+            messagebox.showerror("HueSAR", f"Processing failed:\n{exc}")
+            return
+        self.processed_settings = settings
+        self.processed_input = source
+        if on_done is not None:
+            self.set_busy(False)
+            on_done(path, settings, source)
         else:
-            final_image = colored_image
-        
-        self.display_image(final_image, self.processed_label, "Processed")
-    
-    def enhance_contrast(self, image, clip_limit=0.03):
-        img_float = img_as_float(image)
-        clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(8, 8))
-        enhanced = clahe.apply(img_as_ubyte(img_float))
-        return enhanced
-    
-    def create_custom_medical_colormap(self):
-        colors = [(0, 0, 0.3),      # Dark blue for low values
-                  (0, 0.5, 0.8),    # Blue
-                  (0, 0.8, 0.8),    # Cyan
-                  (0.2, 0.8, 0.2),  # Green
-                  (0.8, 0.8, 0),    # Yellow
-                  (0.8, 0.4, 0),    # Orange
-                  (0.8, 0, 0)]      # Red for high values
-        return LinearSegmentedColormap.from_list('medical', colors)
+            self.set_busy(False, f"Saved {os.path.basename(path)}" if path else "Full resolution")
+        self.show_preview(rgb, self.processed_label)
+    
+    def schedule_preview(self):
+        if self.preview_after is not None:
+            self.root.after_cancel(self.preview_after)
+        self.preview_after = self.root.after(PREVIEW_DEBOUNCE_MS, self.start_preview)
+    
+    def start_preview(self):
+        self.preview_after = None
+        if self.preview_proxy is None:
+            return
+        if self.preview_job is not None:
+            self.preview_job.cancel()
+        self.preview_id += 1
+        self.preview_job = self.preview_executor.submit(run_preview, self.preview_proxy,
+                                                        dict(self.current_settings(),
+                                                             cache=self.stage_cache))
+        self.root.after(20, self.poll_preview, self.preview_job, self.preview_id)
+    
+    def poll_preview(self, job, preview_id):
+        if preview_id != self.preview_id:
+            return
+        if not job.done():
+            self.root.after(20, self.poll_preview, job, preview_id)
+            return
+        
+        self.preview_job = None
+        try:
+            rgb = job.result()
+        except Exception as exc:
+            self.status_label.configure(text=f"Preview failed: {exc}")
+            return
+        if self.job is None:
+            self.status_label.configure(text="Preview")
+        self.show_preview(rgb, self.processed_label)
+    
+    def cancel_processing(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
+        self.job_id += 1
+        self.set_busy(False, "Cancelled")
+    
+    def on_settings_changed(self, *args):
+        if self.live_preview_var.get():
+            # A running full-resolution render no longer matches the settings
+            if self.job is not None:
+                self.cancel_processing()
+            self.schedule_preview()
+        elif self.job is not None:
+            self.process_image()
+    
+    def set_busy(self, busy, status=""):
+        if busy:
+            self.progress.grid()
+            self.cancel_button.grid()
+            self.progress.start(10)
+            self.status_label.configure(text=status)
+        else:
+            self.progress.stop()
+            self.progress.grid_remove()
+            self.cancel_button.grid_remove()
+            self.status_label.configure(text=status)
+    
+    def on_close(self):
+        self.job_id += 1
+        self.preview_id += 1
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.preview_executor.shutdown(wait=False, cancel_futures=True)
+        self.remove_pyramid()
+        self.root.destroy()
 
-    def create_crystal_colormap(self):
-        # Enhanced colormap for better detail visibility
-        colors = [
-            (0.0, 0.0, 0.0),        # Pure black for background
-            (0.1, 0.1, 0.3),        # Dark blue for low intensity
-            (0.2, 0.4, 0.8),        # Bright blue for soft tissues
-            (0.4, 0.8, 0.9),        # Cyan for enhanced soft tissue contrast
-            (0.6, 0.9, 0.6),        # Light green for medium intensity
-            (0.8, 0.9, 0.4),        # Yellow for bone structures
-            (0.9, 0.7, 0.2),        # Orange for enhanced bone details
-            (1.0, 0.5, 0.0),        # Red for high intensity areas
-            (1.0, 1.0, 1.0)         # White for maximum intensity
-        ]
-        return LinearSegmentedColormap.from_list('crystal', colors)
+class ZoomViewer:
+    """Window that zooms (mouse wheel) and pans (drag) a tile pyramid.
 
-    def apply_colormap(self, image, colormap_name='medical'):
-        normalized = img_as_float(image)
-        
-        # Apply additional contrast enhancement for crystal colormap
-        if colormap_name == 'crystal':
-            # Enhance local contrast
-            clahe = cv2.createCLAHE(clipLimit=0.05, tileGridSize=(8, 8))
-            enhanced = clahe.apply(img_as_ubyte(normalized))
-            normalized = img_as_float(enhanced)
-            
-            # Apply gamma correction for better detail visibility
-            normalized = exposure.adjust_gamma(normalized, 0.8)
-            
-            # Normalize again after enhancements
-            normalized = (normalized - normalized.min()) / (normalized.max() - normalized.min())
-        
-        if colormap_name == 'medical':
-            cmap = self.create_custom_medical_colormap()
-        elif colormap_name == 'crystal':
-            cmap = self.create_crystal_colormap()
-        else:
-            cmap = plt.get_cmap(colormap_name)
-        
-        colored = cmap(normalized)
-        colored_bgr = cv2.cvtColor((colored[:, :, :3] * 255).astype(np.uint8), cv2.COLOR_RGB2BGR)
-        return colored_bgr
+    Only the tiles under the window are decoded, at the pyramid level that
+    matches the zoom, so redraws cost the same for any image size.
+    """
+    
+    MAX_SCALE = 8.0
+    
+    def __init__(self, parent, pyramid, title=None):
+        self.pyramid = pyramid
+        self.window = tk.Toplevel(parent)
+        self.window.title(f"HueSAR - {os.path.basename(title)}" if title else "HueSAR")
+        self.window.geometry("1000x750")
+        self.canvas = tk.Canvas(self.window, bg="black", highlightthickness=0)
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+        self.photo = None
+        self.redraw_pending = False
+        self.drag_start = None
+        
+        # Start with the whole image fitted to the window
+        self.scale = min(1000 / pyramid.width, 750 / pyramid.height, 1.0)
+        self.x = self.y = 0.0
+        self.fitted = True
+        
+        self.canvas.bind("<Configure>", self.on_resize)
+        self.canvas.bind("<ButtonPress-1>", self.on_press)
+        self.canvas.bind("<B1-Motion>", self.on_drag)
+        self.canvas.bind("<MouseWheel>", lambda e: self.zoom(e.x, e.y, 1.25 if e.delta > 0 else 0.8))
+        self.canvas.bind("<Button-4>", lambda e: self.zoom(e.x, e.y, 1.25))
+        self.canvas.bind("<Button-5>", lambda e: self.zoom(e.x, e.y, 0.8))
+        self.window.bind("<Destroy>", lambda e: pyramid.clear() if e.widget is self.window else None)
     
-    def blend_with_original(self, original, colored, blend_factor=0.3):
-        original_3ch = cv2.cvtColor(original, cv2.COLOR_GRAY2BGR)
-        blended = cv2.addWeighted(original_3ch, blend_factor, colored, 1.0 - blend_factor, 0)
-        return blended
+    def on_resize(self, event):
+        if self.fitted:
+            self.scale = min(event.width / self.pyramid.width,
+                             event.height / self.pyramid.height, 1.0)
+        self.schedule_redraw()
     
-    def apply_gamma_correction(self, image, gamma=1.0):
-        if gamma == 1.0:
-            return image
-        return exposure.adjust_gamma(image, gamma)
+    def on_press(self, event):
+        self.drag_start = (event.x, event.y, self.x, self.y)
+    
+    def on_drag(self, event):
+        x, y, origin_x, origin_y = self.drag_start
+        self.x = origin_x - (event.x - x) / self.scale
+        self.y = origin_y - (event.y - y) / self.scale
+        self.fitted = False
+        self.schedule_redraw()
+    
+    def zoom(self, cursor_x, cursor_y, factor):
+        # Keep the image point under the cursor in place
+        scale = min(max(self.scale * factor, self.min_scale()), self.MAX_SCALE)
+        self.x += cursor_x / self.scale - cursor_x / scale
+        self.y += cursor_y / self.scale - cursor_y / scale
+        self.scale = scale
+        self.fitted = False
+        self.schedule_redraw()
+    
+    def min_scale(self):
+        return min(self.canvas.winfo_width() / self.pyramid.width,
+                   self.canvas.winfo_height() / self.pyramid.height, 1.0)
+    
+    def schedule_redraw(self):
+        # Wheel and drag events arrive faster than frames; draw once per idle
+        if not self.redraw_pending:
+            self.redraw_pending = True
+            self.window.after_idle(self.redraw)
+    
+    def redraw(self):
+        self.redraw_pending = False
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if width < 2 or height < 2:
+            return
+        view = self.pyramid.render(self.x, self.y, self.scale, (width, height))
+        self.photo = ImageTk.PhotoImage(image=Image.fromarray(
+            cv2.cvtColor(view, cv2.COLOR_BGR2RGB)))
+        self.canvas.delete("all")
+        self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo)
+
+PREVIEW_SIZE = 500  # Longest edge of the preview panels, in pixels
+PREVIEW_DEBOUNCE_MS = 120
+COMPARISON_CELL_SIZE = 320  # Longest edge of each colormap on the comparison sheet
+
+def preview_size(shape, max_size=PREVIEW_SIZE):
+    height, width = shape[:2]
+    if width > height:
+        return max_size, max(int(height * (max_size / width)), 1)
+    return max(int(width * (max_size / height)), 1), max_size
+
+def preview_rgb(image, max_size=PREVIEW_SIZE):
+    """RGB copy of a grayscale or BGR image scaled to fit the preview panel."""
+    with profiling.stage('preview_resize', image) as record:
+        # Scaling first keeps the color conversion at preview size
+        # Area averaging is both faster and alias-free when shrinking
+        image = to_8bit(cv2.resize(np.asarray(image), preview_size(image.shape, max_size),
+                                   interpolation=cv2.INTER_AREA))
+        if len(image.shape) == 2:  # Grayscale
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        else:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        record.output(image)
+    return image
+
+def preview_proxy(image, max_size=PREVIEW_SIZE):
+    """Preview-sized copy of the input that live previews are rendered from."""
+    return cv2.resize(np.asarray(image), preview_size(image.shape, max_size),
+                      interpolation=cv2.INTER_AREA)
+
+def run_preview(proxy, settings):
+    return cv2.cvtColor(colorize(proxy, **settings), cv2.COLOR_BGR2RGB)
+
+def run_comparison(proxy, names, settings):
+    variants = colorize_variants(proxy, names, **settings)
+    sheet = comparison_sheet(variants, names, cell_size=COMPARISON_CELL_SIZE)
+    return cv2.cvtColor(sheet, cv2.COLOR_BGR2RGB)
+
+def run_job(image, settings, path=None):
+    # Runs on the worker thread: colorize, save and scale the preview,
+    # leaving only the PhotoImage to be built on the Tk thread
+    result = colorize(image, **settings)
+    return run_save(result, settings, path)
+
+def run_save(result, settings, path=None):
+    if path is not None and not cv2.imwrite(path, result):
+        raise ValueError(f"could not write image: {path}")
+    return result, preview_rgb(result)
+
+def run_pyramid(image, settings, path):
+    return run_pyramid_save(colorize(image, **settings), settings, path)
+
+def run_pyramid_save(result, settings, path):
+    write_pyramid(path, array_blocks(result), result.shape)
+    return result, preview_rgb(result)
 
 def main():
+    # Any command-line arguments select the headless batch mode
+    if len(sys.argv) > 1:
+        import batch
+        sys.exit(batch.main())
+    
     root = tk.Tk()
     app = MedicalImageColorizer(root)
     root.mainloop()
@@ -0,0 +1,158 @@
+"""Opt-in per-stage timing and memory instrumentation.
+
+Pipeline stages are wrapped in stage(), which does nothing until a hook is
+registered. Each hook receives one StageRecord per stage run:
+
+    import profiling
+
+    stats = profiling.StageStats()
+    profiling.add_hook(stats)
+    ...
+    print(stats.report())
+
+Memory is measured with tracemalloc, which sees both NumPy and OpenCV
+allocations, once enable_memory_tracing() has been called. tracemalloc
+counts every thread, so memory figures are only per stage when stages do
+not run concurrently.
+"""
+import time
+import threading
+import tracemalloc
+from collections import defaultdict, namedtuple
+
+import numpy as np
+
+StageRecord = namedtuple(
+    'StageRecord',
+    'stage seconds allocated_bytes peak_bytes inputs outputs thread')
+StageRecord.__doc__ = """One run of a pipeline stage.
+
+allocated_bytes is the memory still held when the stage returns and
+peak_bytes the most it held at once (both None without memory tracing).
+inputs and outputs are (shape, dtype) pairs of the arrays involved.
+"""
+
+_hooks = []
+_hooks_lock = threading.Lock()
+
+
+def add_hook(hook):
+    """Call hook(record) after every instrumented stage, from the thread that ran it."""
+    with _hooks_lock:
+        _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def enable_memory_tracing():
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def _describe(arrays):
+    return tuple((array.shape, str(array.dtype)) for array in arrays
+                 if isinstance(array, np.ndarray))
+
+
+class _Stage:
+    __slots__ = ('name', 'inputs', 'outputs', 'start', 'memory')
+
+    def __init__(self, name, inputs):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = ()
+
+    def output(self, *arrays):
+        """Record the arrays the stage produced."""
+        self.outputs = arrays
+
+    def __enter__(self):
+        self.memory = None
+        if tracemalloc.is_tracing():
+            self.memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        allocated = peak = None
+        if self.memory is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            allocated, peak = current - self.memory, peak - self.memory
+        record = StageRecord(self.name, seconds, allocated, peak, _describe(self.inputs),
+                             _describe(self.outputs), threading.current_thread().name)
+        for hook in list(_hooks):
+            hook(record)
+        return False
+
+
+class _NoStage:
+    # Shared stand-in used while no hook is registered
+    __slots__ = ()
+
+    def output(self, *arrays):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name, *inputs):
+    """Context manager timing one run of the named stage on the given input arrays."""
+    if not _hooks:
+        return _NO_STAGE
+    return _Stage(name, inputs)
+
+
+class StageStats:
+    """Hook aggregating StageRecords into per-stage percentiles."""
+
+    def __init__(self):
+        self.records = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            self.records[record.stage].append(record)
+
+    def extend(self, records):
+        for record in records:
+            self(record)
+
+    def summary(self):
+        """Per-stage count, total, p50/p95 milliseconds and p95 peak memory in MB."""
+        summary = {}
+        for name, records in self.records.items():
+            ms = np.array([record.seconds for record in records]) * 1000
+            p50, p95 = np.percentile(ms, [50, 95])
+            entry = {"count": len(records), "total_s": round(ms.sum() / 1000, 3),
+                     "p50_ms": round(p50, 3), "p95_ms": round(p95, 3)}
+            peaks = [record.peak_bytes for record in records if record.peak_bytes is not None]
+            if peaks:
+                entry["p95_peak_mb"] = round(np.percentile(peaks, 95) / 2**20, 2)
+            summary[name] = entry
+        return summary
+
+    def report(self):
+        """The summary as a table, slowest stages (by total time) first."""
+        summary = self.summary()
+        lines = [f"{'stage':<20} {'count':>7} {'total s':>9} {'p50 ms':>9} "
+                 f"{'p95 ms':>9} {'p95 peak MB':>12}"]
+        for name, entry in sorted(summary.items(), key=lambda item: -item[1]["total_s"]):
+            peak = entry.get("p95_peak_mb")
+            lines.append(f"{name:<20} {entry['count']:>7} {entry['total_s']:>9.3f} "
+                         f"{entry['p50_ms']:>9.3f} {entry['p95_ms']:>9.3f} "
+                         f"{'-' if peak is None else f'{peak:.2f}':>12}")
+        return "\n".join(lines)
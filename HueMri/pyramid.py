@@ -0,0 +1,288 @@
+"""On-disk image pyramids for zooming and panning results of any size.
+
+A pyramid is a directory of fixed-size tiles at power-of-two levels: level
+0 is the full-resolution result and every further level halves it by
+averaging 2x2 blocks (an odd last row or column is averaged with itself),
+down to a level that fits in one tile.
+
+    pyramid/
+        pyramid.json        layout, written last
+        0/<row>_<col>.png   full resolution
+        1/<row>_<col>.png   half resolution
+        ...
+
+Level 0 is written from a stream of tile-sized blocks, so a scene colorized
+with tiled.iter_colorized_blocks never has to be in memory; each further
+level is built from the 2x2 tiles below it. A viewer then only decodes the
+tiles a viewport covers, at the level matching the zoom, which keeps panning
+and zooming interactive regardless of the source size:
+
+    python pyramid.py scene.tif out_pyramid --colormap bone --tile 256
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from tiled import iter_blocks, iter_colorized_blocks, load_scene
+
+DEFAULT_TILE_SIZE = 256
+TILE_FORMATS = ('png', 'jpg')
+MANIFEST = 'pyramid.json'
+
+# Decoded tiles a Pyramid keeps for redraws, in bytes
+TILE_CACHE_BYTES = 256 * 2**20
+
+
+def level_shapes(shape, tile_size=DEFAULT_TILE_SIZE):
+    """(height, width) of every level, halving (rounding up) until one tile holds it."""
+    height, width = shape[:2]
+    shapes = [(height, width)]
+    while height > tile_size or width > tile_size:
+        height, width = (height + 1) // 2, (width + 1) // 2
+        shapes.append((height, width))
+    return shapes
+
+
+def tile_path(path, level, row, col, tile_format='png'):
+    return os.path.join(path, str(level), f"{row}_{col}.{tile_format}")
+
+
+def _write_tile(path, tile):
+    if not cv2.imwrite(path, tile):
+        raise ValueError(f"could not write tile: {path}")
+
+
+def _read_tile(path):
+    tile = cv2.imread(path, cv2.IMREAD_COLOR)
+    if tile is None:
+        raise ValueError(f"could not read tile: {path}")
+    return tile
+
+
+def array_blocks(image, tile_size=DEFAULT_TILE_SIZE):
+    """Yield the ((y0, x0), block) tiles of an (H, W, 3) array-like for write_pyramid()."""
+    for y0, y1, x0, x1 in iter_blocks(image.shape, (tile_size, tile_size)):
+        yield (y0, x0), np.asarray(image[y0:y1, x0:x1])
+
+
+def write_pyramid(path, blocks, shape, tile_size=DEFAULT_TILE_SIZE, tile_format='png',
+                  workers=None):
+    """Write a tile pyramid of BGR blocks into the directory path.
+
+    blocks yields ((y0, x0), block) for an image of the given (height,
+    width) shape, each block being one tile_size tile of level 0, as
+    iter_colorized_blocks(..., block_size=(tile_size, tile_size)) and
+    array_blocks() produce. Returns the manifest.
+    """
+    if tile_format not in TILE_FORMATS:
+        raise ValueError(f"tile format must be one of {', '.join(TILE_FORMATS)}")
+    shapes = level_shapes(shape, tile_size)
+    for level in range(len(shapes)):
+        os.makedirs(os.path.join(path, str(level)), exist_ok=True)
+    # A manifest from an earlier pyramid in the same place no longer applies
+    manifest_path = os.path.join(path, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    workers = workers or os.cpu_count()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # OpenCV encodes and decodes without the GIL, so tiles are written
+        # on the pool while the next blocks are colorized; a bounded number
+        # of them waits, keeping memory independent of the scene size
+        pending = deque()
+        for (y0, x0), block in blocks:
+            if len(pending) >= 2 * workers:
+                pending.popleft().result()
+            pending.append(executor.submit(
+                _write_tile, tile_path(path, 0, y0 // tile_size, x0 // tile_size, tile_format),
+                block))
+        for future in pending:
+            future.result()
+
+        for level in range(1, len(shapes)):
+            height, width = shapes[level]
+
+            def build(position, level=level):
+                row, col = position
+                _write_tile(tile_path(path, level, row, col, tile_format),
+                            _downsample_children(path, shapes, level, row, col,
+                                                 tile_size, tile_format))
+
+            positions = [(row, col) for row in range(math.ceil(height / tile_size))
+                         for col in range(math.ceil(width / tile_size))]
+            list(executor.map(build, positions))
+
+    manifest = {
+        "height": int(shape[0]),
+        "width": int(shape[1]),
+        "tile_size": tile_size,
+        "format": tile_format,
+        "levels": [{"height": h, "width": w} for h, w in shapes],
+    }
+    partial_path = manifest_path + '.partial'
+    with open(partial_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(partial_path, manifest_path)
+    return manifest
+
+
+def _downsample_children(path, shapes, level, row, col, tile_size, tile_format):
+    # One tile of a level: the 2x2 tiles below it, area-averaged to half
+    # size. An odd last row or column is repeated first, so every pixel
+    # averages a 2x2 block: level 1 is then a direct INTER_AREA half-size
+    # resize of level 0, with odd edges padded the same way (a direct resize
+    # of an odd-sized image instead blends with a fractional scale)
+    child_height, child_width = shapes[level - 1]
+    y0, x0 = 2 * row * tile_size, 2 * col * tile_size
+    y1, x1 = min(y0 + 2 * tile_size, child_height), min(x0 + 2 * tile_size, child_width)
+    mosaic = np.empty((y1 - y0, x1 - x0, 3), np.uint8)
+    for child_row in (2 * row, 2 * row + 1):
+        for child_col in (2 * col, 2 * col + 1):
+            ty, tx = child_row * tile_size - y0, child_col * tile_size - x0
+            if ty >= mosaic.shape[0] or tx >= mosaic.shape[1]:
+                continue
+            tile = _read_tile(tile_path(path, level - 1, child_row, child_col, tile_format))
+            mosaic[ty:ty + tile.shape[0], tx:tx + tile.shape[1]] = tile
+    bottom, right = mosaic.shape[0] % 2, mosaic.shape[1] % 2
+    if bottom or right:
+        mosaic = cv2.copyMakeBorder(mosaic, 0, bottom, 0, right, cv2.BORDER_REPLICATE)
+    size = (mosaic.shape[1] // 2, mosaic.shape[0] // 2)
+    return cv2.resize(mosaic, size, interpolation=cv2.INTER_AREA)
+
+
+class Pyramid:
+    """Read side of a tile pyramid: renders viewports from the visible tiles only."""
+
+    def __init__(self, path, cache_bytes=TILE_CACHE_BYTES):
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        self.path = path
+        self.height = manifest["height"]
+        self.width = manifest["width"]
+        self.tile_size = manifest["tile_size"]
+        self.tile_format = manifest["format"]
+        self.levels = [(level["height"], level["width"]) for level in manifest["levels"]]
+        self.cache_bytes = cache_bytes
+        self.nbytes = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def level_for_scale(self, scale):
+        """Coarsest level that still has at least one pixel per screen pixel at scale."""
+        if scale >= 1.0:
+            return 0
+        return min(int(math.floor(math.log2(1.0 / scale))), len(self.levels) - 1)
+
+    def tile(self, level, row, col):
+        """One decoded BGR tile, from the cache if it was read recently."""
+        key = (level, row, col)
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                return tile
+        tile = _read_tile(tile_path(self.path, level, row, col, self.tile_format))
+        with self._lock:
+            if key not in self._tiles:
+                self._tiles[key] = tile
+                self.nbytes += tile.nbytes
+                while self.nbytes > self.cache_bytes and len(self._tiles) > 1:
+                    self.nbytes -= self._tiles.popitem(last=False)[1].nbytes
+        return tile
+
+    def read_region(self, level, y0, y1, x0, x1):
+        """Rows [y0, y1) and columns [x0, x1) of a level, black outside the image."""
+        height, width = self.levels[level]
+        region = np.zeros((y1 - y0, x1 - x0, 3), np.uint8)
+        size = self.tile_size
+        for row in range(max(y0, 0) // size, (min(y1, height) - 1) // size + 1):
+            for col in range(max(x0, 0) // size, (min(x1, width) - 1) // size + 1):
+                tile = self.tile(level, row, col)
+                ty, tx = row * size, col * size
+                # Overlap of the tile and the region, in level coordinates
+                oy0, oy1 = max(ty, y0), min(ty + tile.shape[0], y1)
+                ox0, ox1 = max(tx, x0), min(tx + tile.shape[1], x1)
+                if oy0 < oy1 and ox0 < ox1:
+                    region[oy0 - y0:oy1 - y0, ox0 - x0:ox1 - x0] = \
+                        tile[oy0 - ty:oy1 - ty, ox0 - tx:ox1 - tx]
+        return region
+
+    def render(self, x, y, scale, size):
+        """BGR view of size (width, height) whose top-left corner shows full-resolution (x, y).
+
+        scale is screen pixels per full-resolution pixel.
+        """
+        width, height = size
+        level = self.level_for_scale(scale)
+        factor = 2 ** level
+        # Level pixels per screen pixel: between 1 and 2 when zoomed out
+        step = 1.0 / (scale * factor)
+        lx, ly = x / factor, y / factor
+        x0, y0 = int(math.floor(lx)), int(math.floor(ly))
+        x1 = int(math.ceil(lx + width * step)) + 1
+        y1 = int(math.ceil(ly + height * step)) + 1
+        region = self.read_region(level, y0, y1, x0, x1)
+        if step > 1.0:
+            # Zoomed out: area averaging over the covered level pixels; the
+            # origin is only placed to the nearest level pixel
+            crop = region[:int(round(height * step)) or 1, :int(round(width * step)) or 1]
+            return cv2.resize(crop, (width, height), interpolation=cv2.INTER_AREA)
+        matrix = np.float32([[step, 0, lx - x0], [0, step, ly - y0]])
+        return cv2.warpAffine(region, matrix, (width, height),
+                              flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                              borderMode=cv2.BORDER_CONSTANT)
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self.nbytes = 0
+
+
+def main(argv=None):
+    from batch import add_pipeline_arguments, pipeline_settings_from_args
+
+    parser = argparse.ArgumentParser(
+        description="Colorize a scene into a tile pyramid for zoomable viewing.")
+    parser.add_argument("scene", help="input scene (.tif/.tiff, .npy or any image OpenCV reads)")
+    parser.add_argument("output", help="directory to write the pyramid to")
+    add_pipeline_arguments(parser)
+    parser.add_argument("--tile", type=int, default=DEFAULT_TILE_SIZE,
+                        help="tile edge in pixels (default: %(default)s)")
+    parser.add_argument("--format", choices=TILE_FORMATS, default='png',
+                        help="tile encoding (default: %(default)s)")
+    parser.add_argument("--scratch-dir", default=None,
+                        help="directory for intermediate planes (default: system temp)")
+    parser.add_argument("--bit-depth", type=int, choices=(8, 16), default=8,
+                        help="decode and process at 8 or 16 bits; memory-mapped TIFF "
+                             "and .npy scenes keep their own (default: %(default)s)")
+    args = parser.parse_args(argv)
+    settings = pipeline_settings_from_args(parser, args)
+
+    if args.tile <= 0 or args.tile % 16:
+        parser.error("--tile must be a positive multiple of 16")
+
+    try:
+        scene = load_scene(args.scene, np.uint16 if args.bit_depth == 16 else np.uint8)
+    except ValueError as exc:
+        parser.error(str(exc))
+    start = time.perf_counter()
+    blocks = iter_colorized_blocks(scene, block_size=(args.tile, args.tile),
+                                   scratch_dir=args.scratch_dir, **settings)
+    manifest = write_pyramid(args.output, blocks, scene.shape, args.tile, args.format)
+    elapsed = time.perf_counter() - start
+    print(f"{scene.shape[1]}x{scene.shape[0]}: {len(manifest['levels'])} levels "
+          f"in {elapsed:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""Persistent, content-addressed cache of colorized results.
+
+Results are stored as the files the batch tool writes (encoded images or
+.npy arrays), named by a hash of the input pixels, the pipeline settings
+and the output format. A repeated job is then a hash of the decoded input
+and a file copy instead of a full colorization and encode.
+
+The cache is safe to share between concurrent worker processes: entries are
+written to a temporary file and renamed into place, so a reader sees either
+a complete entry or none, and an entry removed while being copied is simply
+a miss. An entry's modification time records its last use, and pruning
+removes the least recently used entries once the cache is over its size cap.
+"""
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+
+# Bump when a pipeline change alters results, so older entries stop matching
+CACHE_FORMAT = "huesar-result-1"
+
+RESULT_CACHE_BYTES = 10 * 2**30
+
+# Each writer prunes after adding this fraction of the cap, bounding how far
+# concurrent writers can overshoot it between prunes
+PRUNE_FRACTION = 16
+
+# Temporary files older than this were left by a writer that died
+STALE_PARTIAL_SECONDS = 3600
+
+
+def result_key(image, settings, suffix):
+    """Hex digest identifying the result of colorizing image with settings into a suffix file."""
+    digest = hashlib.blake2b(digest_size=20)
+    description = (CACHE_FORMAT, str(image.dtype), tuple(image.shape),
+                   tuple(sorted(settings.items())), suffix.lower())
+    digest.update(repr(description).encode())
+    # Large stacks (possibly memory-mapped) are hashed a few slices at a time
+    rows = max(1, 2**24 // max(image[0].nbytes, 1)) if image.ndim > 2 else len(image)
+    for start in range(0, len(image), rows):
+        digest.update(np.ascontiguousarray(image[start:start + rows]).data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Directory of cached result files with a size cap and LRU eviction."""
+
+    def __init__(self, root, max_bytes=RESULT_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.written = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def entry_path(self, key, suffix):
+        # Two-level layout keeps directories small
+        return os.path.join(self.root, key[:2], key + suffix.lower())
+
+    def fetch(self, key, suffix, dst_path):
+        """Copy the cached result to dst_path. Returns False on a miss."""
+        path = self.entry_path(key, suffix)
+        try:
+            os.makedirs(os.path.dirname(dst_path) or '.', exist_ok=True)
+            shutil.copyfile(path, dst_path)
+            # The modification time is the entry's last use
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def store(self, key, suffix, src_path):
+        """Add the result file src_path to the cache under key."""
+        path = self.entry_path(key, suffix)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, partial_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.partial')
+        try:
+            with os.fdopen(fd, 'wb') as dst, open(src_path, 'rb') as src:
+                shutil.copyfileobj(src, dst)
+            os.replace(partial_path, path)
+        except BaseException:
+            os.unlink(partial_path)
+            raise
+        self.written += os.path.getsize(path)
+        if self.written * PRUNE_FRACTION >= self.max_bytes:
+            self.prune()
+
+    def entries(self):
+        """(last use, size, path) of every entry, and removes abandoned temporary files."""
+        entries = []
+        now = time.time()
+        for directory in os.scandir(self.root):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith('.partial'):
+                    if now - stat.st_mtime > STALE_PARTIAL_SECONDS:
+                        _remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def prune(self):
+        """Remove least recently used entries until the cache fits its cap. Returns bytes freed."""
+        self.written = 0
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        for _, size, path in entries:
+            if total - freed <= self.max_bytes:
+                break
+            # Another process may be pruning the same entries
+            if _remove(path):
+                freed += size
+        return freed
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+        return True
+    except FileNotFoundError:
+        return False
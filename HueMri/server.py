@@ -0,0 +1,339 @@
+"""Local HTTP colorization service.
+
+    python server.py --port 8765
+
+POST /colorize with an encoded image (PNG, JPEG, TIFF, ...) or a .npy
+array as the body; pipeline settings go in the query string:
+
+    /colorize?modality=CT&subtype=lowdose&colormap=bone&gamma=1.2&blend=0.3&enhance=1&format=png
+
+The response is a PNG (format=png, the default) or a .npy array
+(format=npy). GET /stats returns request counts, latency percentiles and
+queue depth as JSON; GET /health answers 200.
+
+Requests that arrive within a few milliseconds of each other with the same
+settings are micro-batched: the tables they share are built once per batch,
+then every image of the batch runs on the worker pool in parallel. Decoding
+and encoding also run on the worker pool, leaving the event loop free to
+accept connections.
+"""
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import functools
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from engine import MODALITY_SUBTYPES, colorize, gamma_lut, pipeline_settings, tone_lut
+
+MAX_BODY_BYTES = 512 * 2**20
+
+# Latencies kept for the percentiles reported by /stats
+LATENCY_WINDOW = 2048
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class RequestError(Exception):
+    """A client error, answered with its status code and message."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_settings(query):
+    """colorize() keyword arguments and the output format from a query string."""
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    modality = params.get("modality", "MRI")
+    if modality not in MODALITY_SUBTYPES:
+        raise RequestError(400, f"modality must be one of {', '.join(MODALITY_SUBTYPES)}")
+    subtype = params.get("subtype", MODALITY_SUBTYPES[modality][0])
+    if subtype not in MODALITY_SUBTYPES[modality]:
+        raise RequestError(400, f"subtype for {modality} must be one of "
+                                f"{', '.join(MODALITY_SUBTYPES[modality])}")
+    output_format = params.get("format", "png")
+    if output_format not in ("png", "npy"):
+        raise RequestError(400, "format must be png or npy")
+    try:
+        settings = {
+            "modality": modality,
+            "subtype": subtype,
+            "colormap_name": params.get("colormap", "crystal"),
+            "gamma": float(params.get("gamma", 1.0)),
+            "blend_factor": float(params.get("blend", 0.3)),
+            "enhance": params.get("enhance", "1").lower() not in ("0", "false", "no"),
+        }
+    except ValueError:
+        raise RequestError(400, "gamma and blend must be numbers")
+    if not settings["gamma"] >= 0:
+        raise RequestError(400, "gamma must be a non-negative number")
+    return settings, output_format
+
+
+def decode_image(body):
+    """Decode an uploaded .npy array or encoded image to 8- or 16-bit grayscale."""
+    if body[:6] == b'\x93NUMPY':
+        image = np.load(io.BytesIO(body), allow_pickle=False)
+        if image.dtype not in (np.uint8, np.uint16) or image.ndim != 2:
+            raise RequestError(400, "arrays must be 2D uint8 or uint16")
+        return image
+
+    import cv2
+
+    # 16-bit PNGs and TIFFs keep their depth
+    image = cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_ANYDEPTH)
+    if image is None:
+        raise RequestError(400, "could not decode image")
+    return image
+
+
+def encode_result(result, output_format):
+    if output_format == "npy":
+        buffer = io.BytesIO()
+        np.save(buffer, result, allow_pickle=False)
+        return buffer.getvalue(), "application/octet-stream"
+
+    import cv2
+
+    ok, encoded = cv2.imencode('.png', result)
+    if not ok:
+        raise RuntimeError("could not encode result")
+    return encoded.tobytes(), "image/png"
+
+
+def warm_tables(settings, dtypes):
+    """Build the tables every image of a batch shares before the images go to the workers."""
+    # The crystal map's colormap table depends on each image's own gray
+    # range, so only its gamma curve is shared
+    _, gamma = pipeline_settings(settings["modality"], settings["subtype"],
+                                 settings["gamma"], settings["enhance"])
+    for dtype in dtypes:
+        bits = np.dtype(dtype).itemsize * 8
+        if settings["colormap_name"] != 'crystal':
+            tone_lut(settings["colormap_name"], gamma, settings["blend_factor"], bits)
+        elif gamma != 1.0:
+            gamma_lut(gamma, bits)
+
+
+class Batcher:
+    """Collect concurrent requests with the same settings into batches for the worker pool."""
+
+    def __init__(self, executor, max_batch=16, max_delay=0.005):
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = {}
+        self.queued = 0
+        self.running = 0
+        self.batches = 0
+        self.batched_images = 0
+
+    async def colorize(self, image, settings):
+        loop = asyncio.get_running_loop()
+        key = tuple(sorted(settings.items()))
+        future = loop.create_future()
+        batch = self.pending.get(key)
+        if batch is None:
+            batch = self.pending[key] = []
+            loop.call_later(self.max_delay, self._flush, key, batch)
+        batch.append((image, future))
+        self.queued += 1
+        if len(batch) >= self.max_batch:
+            self._flush(key, batch)
+        return await future
+
+    def _flush(self, key, batch):
+        # The timer of a batch that already went out on size finds it gone
+        if self.pending.get(key) is not batch:
+            return
+        del self.pending[key]
+        self.queued -= len(batch)
+        self.running += len(batch)
+        self.batches += 1
+        self.batched_images += len(batch)
+        asyncio.ensure_future(self._run(batch, dict(key)))
+
+    async def _run(self, batch, settings):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.executor, warm_tables, settings,
+                                       {image.dtype for image, _ in batch})
+        except Exception as exc:
+            # Invalid settings fail every image of the batch the same way
+            self.running -= len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        await asyncio.gather(*(self._run_one(image, future, settings)
+                               for image, future in batch))
+
+    async def _run_one(self, image, future, settings):
+        # Each image is its own executor job, so a batch spreads over the pool
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(
+                self.executor, functools.partial(colorize, image, **settings))
+        except Exception as exc:
+            if not future.done():
+                future.set_exception(exc)
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self.running -= 1
+
+
+class ColorizeServer:
+    def __init__(self, workers=None, max_batch=16, max_delay=0.005, max_body=MAX_BODY_BYTES):
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        self.batcher = Batcher(self.executor, max_batch, max_delay)
+        self.max_body = max_body
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.active = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split(None, 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > self.max_body:
+                    await self.respond(writer, 413, b"request body too large\n", "text/plain")
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload, content_type = await self.dispatch(method, target, body)
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and version.strip() == 'HTTP/1.1')
+                await self.respond(writer, status, payload, content_type, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        if url.path == '/health':
+            return 200, b"ok\n", "text/plain"
+        if url.path == '/stats':
+            return 200, json.dumps(self.stats(), indent=2).encode(), "application/json"
+        if url.path != '/colorize':
+            return 404, b"not found\n", "text/plain"
+        if method != 'POST':
+            return 405, b"use POST\n", "text/plain"
+
+        start = time.perf_counter()
+        self.requests += 1
+        self.active += 1
+        loop = asyncio.get_running_loop()
+        try:
+            settings, output_format = parse_settings(url.query)
+            image = await loop.run_in_executor(self.executor, decode_image, body)
+            result = await self.batcher.colorize(image, settings)
+            payload, content_type = await loop.run_in_executor(
+                self.executor, encode_result, result, output_format)
+        except RequestError as exc:
+            self.errors += 1
+            return exc.status, f"{exc}\n".encode(), "text/plain"
+        except (ValueError, KeyError) as exc:
+            # Unknown colormaps and invalid parameters surface from the engine
+            self.errors += 1
+            message = exc.args[0] if exc.args else exc
+            return 400, f"{message}\n".encode(), "text/plain"
+        except Exception as exc:
+            self.errors += 1
+            return 500, f"{type(exc).__name__}: {exc}\n".encode(), "text/plain"
+        finally:
+            self.active -= 1
+        self.latencies.append(time.perf_counter() - start)
+        return 200, payload, content_type
+
+    async def respond(self, writer, status, payload, content_type, keep_alive=False):
+        head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1'))
+        writer.write(payload)
+        await writer.drain()
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        batcher = self.batcher
+        stats = {
+            "uptime_s": round(time.time() - self.started, 1),
+            "requests": self.requests,
+            "errors": self.errors,
+            "active": self.active,
+            "queue_depth": batcher.queued,
+            "running": batcher.running,
+            "batches": batcher.batches,
+            "mean_batch_size": round(batcher.batched_images / batcher.batches, 2)
+                               if batcher.batches else 0.0,
+        }
+        if latencies.size:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            stats["latency_ms"] = {"p50": round(p50, 2), "p95": round(p95, 2),
+                                   "p99": round(p99, 2), "max": round(latencies.max(), 2),
+                                   "window": int(latencies.size)}
+        return stats
+
+
+async def serve(host, port, **options):
+    server = ColorizeServer(**options)
+    listener = await asyncio.start_server(server.handle_connection, host, port)
+    print(f"Serving on http://{host}:{port}/colorize")
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the colorization pipeline over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to bind (default: %(default)s, local only)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker threads (default: one per core)")
+    parser.add_argument("--max-batch", type=int, default=16,
+                        help="most requests run together as one batch (default: %(default)s)")
+    parser.add_argument("--batch-delay-ms", type=float, default=5.0,
+                        help="how long a batch waits for more requests (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if args.max_batch < 1:
+        parser.error("--max-batch must be at least 1")
+
+    try:
+        asyncio.run(serve(args.host, args.port, workers=args.workers,
+                          max_batch=args.max_batch, max_delay=args.batch_delay_ms / 1000))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
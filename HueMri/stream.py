@@ -0,0 +1,390 @@
+"""Streaming colorization of video files and frame sequences (cine MRI, fluoroscopy).
+
+Decoding, colorizing and encoding overlap: frames are read on their own
+thread into a bounded queue, colorized on a thread pool (OpenCV and the
+NumPy gathers release the GIL), and handed back in input order to be
+encoded while later frames are still in flight. Every stage waits when the
+one after it falls behind, so memory stays at a fixed number of frames
+however long the sequence is.
+
+    python stream.py cine.mp4 cine_hot.mp4 --modality MRI --colormap hot
+    python stream.py fluoro_frames/ out_frames/ --modality X-ray
+
+Sources are video files, directories of numbered images or DICOM slices,
+multi-frame DICOM files and (N, H, W) .npy stacks. Output is a video file,
+or a directory of numbered images for any other path.
+
+With --clahe-max-error, 16-bit frames run their CLAHE stages one after
+another in frame order through clahe.IncrementalCLAHE, which reuses each
+frame's tile tables for the next; only the table lookups that color them
+go to the pool.
+"""
+import os
+import sys
+import time
+import queue
+import argparse
+import functools
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import profiling
+from clahe import IncrementalCLAHE
+from engine import (CRYSTAL_CLIP_LIMIT, apply_crystal_tables, apply_tone_map, colorize,
+                    gamma_lut, gather, pipeline_settings)
+from loaders import DICOM_EXTENSIONS, load_array, load_dicom, load_dicom_cine, load_image
+
+VIDEO_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.avi', '.mkv', '.mpg', '.mpeg', '.wmv')
+FRAME_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+
+# Codec per output container; MJPG is the one AVI writer every build has
+VIDEO_FOURCC = {'.mp4': 'mp4v', '.m4v': 'mp4v', '.mov': 'mp4v', '.avi': 'MJPG',
+                '.mkv': 'XVID'}
+
+# Frame rate for sources that do not record one
+DEFAULT_FPS = 25.0
+
+# Decoded frames waiting for a worker
+READ_AHEAD = 8
+
+FrameSource = namedtuple('FrameSource', 'frames count fps')
+FrameSource.__doc__ = """An iterable of 2D grayscale frames, their number and frame rate.
+
+count and fps are None when the source does not know them up front.
+"""
+
+_END = object()
+
+
+def open_frames(source, dtype=np.uint8):
+    """Open a video file, frame directory, multi-frame DICOM file or .npy stack as a FrameSource.
+
+    Frames are decoded lazily as the source is iterated. Image and DICOM
+    frames come back as dtype; video frames are 8-bit and scaled to the
+    16-bit range for a uint16 dtype, and .npy stacks keep their own dtype.
+    """
+    if os.path.isdir(source):
+        names = sorted(os.listdir(source))
+        dicom = [os.path.join(source, name) for name in names
+                 if name.lower().endswith(DICOM_EXTENSIONS)]
+        if dicom:
+            frames = load_dicom(dicom, dtype=dtype)
+            return FrameSource(iter(frames), len(frames), None)
+        paths = [os.path.join(source, name) for name in names
+                 if name.lower().endswith(FRAME_EXTENSIONS)]
+        if not paths:
+            raise ValueError(f"no frames found in {source}")
+        return FrameSource((load_image(path, dtype) for path in paths), len(paths), None)
+
+    ext = os.path.splitext(source)[1].lower()
+    if ext == '.npy':
+        stack = load_array(source)
+        if stack.ndim != 3:
+            raise ValueError(f"expected an (N, H, W) stack: {source}")
+        return FrameSource(iter(stack), len(stack), None)
+    if ext in DICOM_EXTENSIONS:
+        frames, fps = load_dicom_cine(source, dtype=dtype)
+        return FrameSource(iter(frames), len(frames), fps)
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"could not open video: {source}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or None
+    count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+    return FrameSource(_video_frames(capture, dtype), count, fps)
+
+
+def _video_frames(capture, dtype):
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if np.dtype(dtype) == np.uint16:
+                gray = np.multiply(gray, 257, dtype=np.uint16)
+            yield gray
+    finally:
+        capture.release()
+
+
+def read_ahead(frames, depth=READ_AHEAD):
+    """Iterate frames on a background thread, keeping at most depth decoded frames waiting.
+
+    Errors raised while reading are re-raised by the consumer; closing the
+    iterator early stops the reading thread.
+    """
+    waiting = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        # Blocks while the queue is full, so decoding waits for the workers
+        while not stop.is_set():
+            try:
+                waiting.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            iterator = iter(frames)
+            while True:
+                with profiling.stage('read') as record:
+                    frame = next(iterator, _END)
+                    if frame is not _END:
+                        record.output(frame)
+                if frame is _END:
+                    break
+                if not put((frame, None)):
+                    return
+        except BaseException as exc:
+            put((_END, exc))
+            return
+        put((_END, None))
+
+    thread = threading.Thread(target=read, name='frame-reader', daemon=True)
+    thread.start()
+    try:
+        while True:
+            frame, error = waiting.get()
+            if frame is _END:
+                if error is not None:
+                    raise error
+                return
+            yield frame
+    finally:
+        stop.set()
+        thread.join()
+
+
+class SequentialCLAHE:
+    """The CLAHE stages of colorize() for 16-bit frames, run in frame order with IncrementalCLAHE.
+
+    Each stage keeps one IncrementalCLAHE across the frames, so a frame's
+    result is within max_error levels of colorize()'s (exact with 0).
+    enhance() returns the rest of the pipeline, table lookups only, as a
+    function of out that may run on any thread.
+    """
+
+    def __init__(self, max_error, executor=None, modality="MRI", subtype="1.5T",
+                 colormap_name="crystal", gamma=1.0, blend_factor=0.3, enhance=True):
+        clip_limit, self.gamma = pipeline_settings(modality, subtype, gamma, enhance)
+        self.colormap_name = colormap_name
+        self.blend_factor = blend_factor
+        self.clahe = self.crystal_clahe = None
+        if clip_limit is not None:
+            self.clahe = IncrementalCLAHE(clip_limit, max_error=max_error, executor=executor)
+        if colormap_name == 'crystal':
+            self.crystal_clahe = IncrementalCLAHE(CRYSTAL_CLIP_LIMIT, max_error=max_error,
+                                                  executor=executor)
+
+    def enhance(self, frame):
+        if self.clahe is not None:
+            with profiling.stage('clahe', frame) as record:
+                frame = self.clahe.apply(frame)
+                record.output(frame)
+        if self.crystal_clahe is None:
+            return functools.partial(apply_tone_map, frame, self.colormap_name, self.gamma,
+                                     self.blend_factor)
+
+        with profiling.stage('crystal_clahe', frame) as record:
+            toned = gather(gamma_lut(self.gamma, 16), frame) if self.gamma != 1.0 else frame
+            enhanced = self.crystal_clahe.apply(toned)
+            lo, hi = (int(v) for v in cv2.minMaxLoc(enhanced)[:2])
+            record.output(toned, enhanced)
+        return functools.partial(apply_crystal_tables, toned, enhanced, lo, hi,
+                                 self.blend_factor)
+
+
+def iter_colorized_frames(frames, workers=None, depth=None, clahe_max_error=None,
+                          **settings):
+    """Colorize an iterable of 2D frames on a thread pool, yielding BGR frames in input order.
+
+    At most depth frames (default: two per worker) are colorized at once;
+    reading the next one waits for the oldest to finish, so a slow consumer
+    holds up decoding instead of piling frames up in memory. Results are
+    written into depth + 1 reused buffers: a yielded frame is only valid
+    until the next one is requested, and must be copied to be kept.
+
+    With a clahe_max_error, 16-bit frames go through a SequentialCLAHE here,
+    in frame order, and only their table lookups run on the pool.
+    """
+    workers = workers or os.cpu_count()
+    depth = depth or 2 * workers
+    buffers = [None] * (depth + 1)
+
+    def buffer(slot, shape):
+        out = buffers[slot]
+        if out is None or out.shape[:2] != shape:
+            out = buffers[slot] = np.empty(shape + (3,), np.uint8)
+        return out
+
+    def render(slot, frame):
+        return colorize(frame, out=buffer(slot, frame.shape), **settings)
+
+    def finish(slot, shape, tables):
+        return tables(out=buffer(slot, shape))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stream') as executor:
+        sequential = None
+        if clahe_max_error is not None:
+            sequential = SequentialCLAHE(clahe_max_error, executor, **settings)
+        # Futures are queued in frame order, so the oldest one is always
+        # the next frame out, however the workers finish
+        pending = deque()
+        for index, frame in enumerate(frames):
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+            slot = index % len(buffers)
+            if sequential is not None and frame.dtype == np.uint16:
+                pending.append(executor.submit(finish, slot, frame.shape,
+                                               sequential.enhance(frame)))
+            else:
+                pending.append(executor.submit(render, slot, frame))
+        while pending:
+            yield pending.popleft().result()
+
+
+class FrameWriter:
+    """Encodes BGR frames into a video file, or as numbered images into a directory.
+
+    Paths with a video extension are written as video; any other path is
+    taken as a directory of frame_000000.<frame_format> files.
+    """
+
+    def __init__(self, path, fps=DEFAULT_FPS, frame_format='png'):
+        self.path = path
+        self.fps = fps or DEFAULT_FPS
+        self.frame_format = frame_format
+        self.count = 0
+        self._video = None
+        self.is_video = os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+        if not self.is_video:
+            os.makedirs(path, exist_ok=True)
+
+    def write(self, frame):
+        with profiling.stage('write', frame):
+            if self.is_video:
+                if self._video is None:
+                    self._open_video(frame.shape)
+                self._video.write(frame)
+            else:
+                path = os.path.join(self.path, f"frame_{self.count:06d}.{self.frame_format}")
+                if not cv2.imwrite(path, frame):
+                    raise ValueError(f"could not write frame: {path}")
+        self.count += 1
+
+    def _open_video(self, shape):
+        # The frame size is only known once the first frame arrives
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        ext = os.path.splitext(self.path)[1].lower()
+        fourcc = cv2.VideoWriter_fourcc(*VIDEO_FOURCC.get(ext, 'mp4v'))
+        self._video = cv2.VideoWriter(self.path, fourcc, self.fps, (shape[1], shape[0]))
+        if not self._video.isOpened():
+            raise ValueError(f"could not open video for writing: {self.path}")
+
+    def close(self):
+        if self._video is not None:
+            self._video.release()
+            self._video = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def colorize_stream(source, output, workers=None, depth=None, read_depth=READ_AHEAD,
+                    dtype=np.uint8, fps=None, frame_format='png', clahe_max_error=None,
+                    **settings):
+    """Colorize a video or frame sequence into output with decode, colorize and encode overlapped.
+
+    fps overrides the source's frame rate for video output. clahe_max_error
+    is passed on to iter_colorized_frames(). Returns the number of frames
+    written.
+    """
+    frames = open_frames(source, dtype)
+    decoded = read_ahead(frames.frames, read_depth)
+    colorized = iter_colorized_frames(decoded, workers=workers, depth=depth,
+                                      clahe_max_error=clahe_max_error, **settings)
+    with FrameWriter(output, fps or frames.fps, frame_format) as writer:
+        try:
+            for frame in colorized:
+                writer.write(frame)
+        finally:
+            # Stop the workers and the reading thread if encoding failed
+            colorized.close()
+            decoded.close()
+    return writer.count
+
+
+def main(argv=None):
+    from batch import add_pipeline_arguments, pipeline_settings_from_args
+
+    parser = argparse.ArgumentParser(
+        description="Colorize a video or frame sequence with streaming, overlapped stages.")
+    parser.add_argument("source", help="video file, directory of frames or DICOM slices, "
+                                       "multi-frame .dcm or (N, H, W) .npy stack")
+    parser.add_argument("output", help="video file (.mp4, .avi, ...) or a directory for "
+                                       "numbered frames")
+    add_pipeline_arguments(parser)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="colorizing threads (default: one per core)")
+    parser.add_argument("--depth", type=int, default=None,
+                        help="frames colorized at once (default: two per worker)")
+    parser.add_argument("--read-ahead", type=int, default=READ_AHEAD,
+                        help="decoded frames waiting for a worker (default: %(default)s)")
+    parser.add_argument("--fps", type=float, default=None,
+                        help="output frame rate (default: the source's, else "
+                             f"{DEFAULT_FPS:g})")
+    parser.add_argument("--frame-format", choices=("png", "jpg", "tif"), default="png",
+                        help="encoding of numbered frames (default: %(default)s)")
+    parser.add_argument("--bit-depth", type=int, choices=(8, 16), default=8,
+                        help="decode image and DICOM frames at 8 or 16 bits "
+                             "(default: %(default)s)")
+    parser.add_argument("--clahe-max-error", type=int, default=None,
+                        help="16-bit frames: run CLAHE frame after frame, reusing tile "
+                             "tables while results stay within this many 16-bit levels "
+                             "of the exact ones (0 keeps them exact)")
+    parser.add_argument("--profile", action="store_true",
+                        help="report per-stage timings (p50/p95)")
+    args = parser.parse_args(argv)
+    settings = pipeline_settings_from_args(parser, args)
+    for flag in ("workers", "depth", "read_ahead"):
+        value = getattr(args, flag)
+        if value is not None and value <= 0:
+            parser.error(f"--{flag.replace('_', '-')} must be positive")
+    if args.clahe_max_error is not None and args.clahe_max_error < 0:
+        parser.error("--clahe-max-error must not be negative")
+
+    stats = profiling.StageStats()
+    if args.profile:
+        profiling.add_hook(stats)
+    start = time.perf_counter()
+    try:
+        count = colorize_stream(args.source, args.output, workers=args.workers,
+                                depth=args.depth, read_depth=args.read_ahead,
+                                dtype=np.uint16 if args.bit_depth == 16 else np.uint8,
+                                fps=args.fps, frame_format=args.frame_format,
+                                clahe_max_error=args.clahe_max_error, **settings)
+    except ValueError as exc:
+        parser.error(str(exc))
+    finally:
+        profiling.remove_hook(stats)
+    elapsed = time.perf_counter() - start
+    print(f"{count} frames in {elapsed:.2f} s ({count / elapsed if elapsed else 0.0:.1f} fps)")
+    if args.profile and stats.records:
+        print("\nPer-stage profile (stages overlap, so times do not add up):")
+        print(stats.report())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""Tiled execution for scenes too large to colorize in memory.
+
+The scene is read and colorized one block at a time, and every block goes
+straight to its place in the output, so peak memory is bounded by the block
+size rather than the scene size. CLAHE is computed as two streaming passes
+(tile histograms, then per-block interpolation of the global tables; see
+clahe.py), which makes the result identical to colorizing the whole scene
+at once: there are no seams to hide and no overlap to size.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+import clahe
+from engine import (CRYSTAL_CLIP_LIMIT, apply_crystal_tables, gamma_lut, gather,
+                    pipeline_settings, tone_lut)
+from loaders import load_image, open_output
+
+DEFAULT_BLOCK_SIZE = (512, 512)
+
+
+def iter_blocks(shape, block_size=DEFAULT_BLOCK_SIZE):
+    """Yield (y0, y1, x0, x1) for every block of a 2D shape in row-major order."""
+    height, width = shape[:2]
+    block_rows, block_cols = block_size
+    for y0 in range(0, height, block_rows):
+        for x0 in range(0, width, block_cols):
+            yield y0, min(y0 + block_rows, height), x0, min(x0 + block_cols, width)
+
+
+def _streaming_clahe(image, clip_limit):
+    # Global CLAHE tables of an array-like, computed without loading it whole.
+    # 16-bit tables are clipped at 256 levels, as engine.equalize() clips them
+    geometry = clahe.clahe_geometry(image.shape, dtype=image.dtype)
+    hist = clahe.tile_histograms(image, geometry)
+    if geometry.hist_size > 256:
+        luts = clahe.coarse_clahe_luts(hist, geometry, clip_limit)
+    else:
+        luts = clahe.clahe_luts(hist, geometry, clip_limit)
+    # Converted once rather than for every block
+    return geometry, luts.astype(np.float32)
+
+
+def iter_colorized_blocks(scene, modality="MRI", subtype="1.5T", colormap_name="crystal",
+                          gamma=1.0, blend_factor=0.3, enhance=True,
+                          block_size=DEFAULT_BLOCK_SIZE, scratch_dir=None):
+    """Colorize a 2D uint8 or uint16 array-like block by block.
+
+    Yields ((y0, x0), bgr_block) in row-major order. The blocks match what
+    engine.colorize() returns for the whole scene.
+    """
+    if scene.dtype not in (np.uint8, np.uint16) or scene.ndim != 2:
+        raise ValueError(f"tiled colorization expects a 2D uint8 or uint16 scene, "
+                         f"got {scene.ndim}D {scene.dtype}")
+
+    bits = scene.dtype.itemsize * 8
+    clip_limit, gamma = pipeline_settings(modality, subtype, gamma, enhance)
+    if clip_limit is not None:
+        geometry, luts = _streaming_clahe(scene, clip_limit)
+
+    def enhanced_block(y0, y1, x0, x1):
+        block = np.asarray(scene[y0:y1, x0:x1])
+        if clip_limit is None:
+            return block
+        return clahe.interpolate(block, luts, geometry, y0, x0)
+
+    if colormap_name != 'crystal':
+        table = tone_lut(colormap_name, gamma, blend_factor, bits)
+        for y0, y1, x0, x1 in iter_blocks(scene.shape, block_size):
+            yield (y0, x0), gather(table, enhanced_block(y0, y1, x0, x1))
+        return
+
+    # The crystal map needs a second global CLAHE and the gray range of its
+    # output, so the intermediate planes are staged in scratch memmaps
+    with tempfile.TemporaryDirectory(dir=scratch_dir) as tmp:
+        toned = np.memmap(os.path.join(tmp, 'toned.raw'), scene.dtype, 'w+', shape=scene.shape)
+        crystal = np.memmap(os.path.join(tmp, 'crystal.raw'), scene.dtype, 'w+',
+                            shape=scene.shape)
+
+        curve = gamma_lut(gamma, bits) if gamma != 1.0 else None
+        for y0, y1, x0, x1 in iter_blocks(scene.shape, block_size):
+            block = enhanced_block(y0, y1, x0, x1)
+            toned[y0:y1, x0:x1] = block if curve is None else np.take(curve, block)
+
+        crystal_geometry, crystal_luts = _streaming_clahe(toned, CRYSTAL_CLIP_LIMIT)
+        lo, hi = 2**bits - 1, 0
+        for y0, y1, x0, x1 in iter_blocks(scene.shape, block_size):
+            block = clahe.interpolate(np.asarray(toned[y0:y1, x0:x1]), crystal_luts,
+                                      crystal_geometry, y0, x0)
+            crystal[y0:y1, x0:x1] = block
+            lo, hi = min(lo, int(block.min())), max(hi, int(block.max()))
+
+        for y0, y1, x0, x1 in iter_blocks(scene.shape, block_size):
+            yield (y0, x0), apply_crystal_tables(np.asarray(toned[y0:y1, x0:x1]),
+                                                 np.asarray(crystal[y0:y1, x0:x1]),
+                                                 lo, hi, blend_factor)
+        del toned, crystal
+
+
+def load_scene(path, dtype=np.uint8):
+    """Read a scene for tiled colorization, checking it is a 2D uint8 or uint16 image.
+
+    Decoded images come back as dtype; memory-mapped TIFF and .npy scenes
+    keep their own dtype (see loaders.load_image).
+    """
+    scene = load_image(path, dtype)
+    if scene.dtype not in (np.uint8, np.uint16) or scene.ndim != 2:
+        raise ValueError(f"expected a 2D 8- or 16-bit grayscale scene, got "
+                         f"{scene.ndim}D {scene.dtype}: {path}")
+    return scene
+
+
+def colorize_tiled(scene, out=None, block_size=DEFAULT_BLOCK_SIZE, **settings):
+    """Colorize a scene block by block into out, an (H, W, 3) uint8 array-like such as a memmap."""
+    if out is None:
+        out = np.empty(scene.shape + (3,), np.uint8)
+    for (y0, x0), block in iter_colorized_blocks(scene, block_size=block_size, **settings):
+        out[y0:y0 + block.shape[0], x0:x0 + block.shape[1]] = block
+    return out
+
+
+def write_tiled_tiff(path, scene, tile_size=DEFAULT_BLOCK_SIZE, **settings):
+    """Colorize a scene straight into a tiled RGB BigTIFF, one tile at a time."""
+    import tifffile
+
+    blocks = iter_colorized_blocks(scene, block_size=tile_size, **settings)
+    with tifffile.TiffWriter(path, bigtiff=True) as tif:
+        tif.write((block[..., ::-1] for _, block in blocks),
+                  shape=scene.shape + (3,), dtype=np.uint8,
+                  tile=tuple(tile_size), photometric='rgb')
+
+
+def main(argv=None):
+    from batch import add_pipeline_arguments, pipeline_settings_from_args
+
+    parser = argparse.ArgumentParser(
+        description="Colorize a large scene tile by tile with bounded memory.")
+    parser.add_argument("scene", help="input scene (.tif/.tiff, .npy or any image OpenCV reads)")
+    parser.add_argument("output", help="output path: .tif/.tiff for a tiled TIFF, "
+                                       ".npy for a memory-mapped array")
+    add_pipeline_arguments(parser)
+    parser.add_argument("--tile", type=int, default=DEFAULT_BLOCK_SIZE[0],
+                        help="tile edge in pixels (default: %(default)s)")
+    parser.add_argument("--scratch-dir", default=None,
+                        help="directory for intermediate planes (default: system temp)")
+    parser.add_argument("--bit-depth", type=int, choices=(8, 16), default=8,
+                        help="decode and process at 8 or 16 bits; memory-mapped TIFF "
+                             "and .npy scenes keep their own (default: %(default)s)")
+    args = parser.parse_args(argv)
+    settings = pipeline_settings_from_args(parser, args)
+    settings["scratch_dir"] = args.scratch_dir
+
+    if args.tile <= 0 or args.tile % 16:
+        parser.error("--tile must be a positive multiple of 16")
+    tile_size = (args.tile, args.tile)
+
+    try:
+        scene = load_scene(args.scene, np.uint16 if args.bit_depth == 16 else np.uint8)
+    except ValueError as exc:
+        parser.error(str(exc))
+    start = time.perf_counter()
+    ext = os.path.splitext(args.output)[1].lower()
+    if ext in ('.tif', '.tiff'):
+        write_tiled_tiff(args.output, scene, tile_size, **settings)
+    elif ext == '.npy':
+        out = open_output(args.output, scene.shape + (3,))
+        colorize_tiled(scene, out, tile_size, **settings)
+        out.flush()
+    else:
+        parser.error("output must be a .tif/.tiff or .npy file")
+    elapsed = time.perf_counter() - start
+    print(f"{scene.shape[1]}x{scene.shape[0]} in {elapsed:.2f} s "
+          f"({scene.size / 1e6 / elapsed:.1f} MP/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""Volumetric colorization of (N, H, W) MRI/CT stacks.
+
+The pointwise stages (gamma, colormap, blend) are one table gather over the
+whole stack instead of one call per slice. CLAHE runs per slice on a thread
+pool (OpenCV releases the GIL), or optionally as a true 3D CLAHE. 16-bit
+stacks can instead run it slice after slice with clahe.IncrementalCLAHE,
+which reuses each slice's tile tables for the next.
+"""
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from clahe import IncrementalCLAHE
+from engine import (CRYSTAL_CLIP_LIMIT, apply_crystal_tables, equalize, gamma_lut, gather,
+                    pipeline_settings, tone_lut)
+
+# scikit-image's precision-loss warnings from the 3D CLAHE conversion
+warnings.filterwarnings("ignore", category=UserWarning, module="skimage")
+
+
+def clahe_slices(volume, clip_limit, executor, max_error=None):
+    """2D CLAHE of every slice, run concurrently; each thread uses its own CLAHE object.
+
+    With a max_error, a uint16 stack is enhanced in order with an
+    IncrementalCLAHE instead, within max_error levels of the per-slice
+    result, and only the interpolation is spread over the executor.
+    """
+    enhanced = np.empty(volume.shape, volume.dtype)
+    if max_error is not None and volume.dtype == np.uint16:
+        incremental = IncrementalCLAHE(clip_limit, max_error=max_error, executor=executor)
+        for index in range(volume.shape[0]):
+            incremental.apply(volume[index], out=enhanced[index])
+        return enhanced
+
+    def enhance(index):
+        equalize(volume[index], clip_limit, out=enhanced[index], parallel=False)
+
+    list(executor.map(enhance, range(volume.shape[0])))
+    return enhanced
+
+
+def clahe_3d(volume, clip_limit):
+    """CLAHE over 3D neighbourhoods (scikit-image), so contrast is consistent across slices.
+
+    scikit-image normalizes clip_limit differently from OpenCV, so the same
+    value gives a different (generally stronger) enhancement than the 2D path.
+    """
+    from skimage import exposure
+    from skimage.util import img_as_ubyte, img_as_uint
+
+    convert = img_as_uint if volume.dtype == np.uint16 else img_as_ubyte
+    return convert(exposure.equalize_adapthist(np.asarray(volume), clip_limit=clip_limit))
+
+
+def colorize_volume(volume, modality="MRI", subtype="1.5T", colormap_name="crystal",
+                    gamma=1.0, blend_factor=0.3, enhance=True, out=None,
+                    workers=None, use_3d_clahe=False, clahe_max_error=None):
+    """Colorize an (N, H, W) uint8 or uint16 stack into an (N, H, W, 3) uint8 BGR stack.
+
+    With the default 2D CLAHE every slice matches engine.colorize() on that
+    slice. clahe_max_error lets a uint16 stack reuse CLAHE tables from slice
+    to slice (see clahe_slices). out may be a preallocated array such as a
+    memmap.
+    """
+    if volume.dtype not in (np.uint8, np.uint16) or volume.ndim != 3:
+        raise ValueError("expected an (N, H, W) uint8 or uint16 volume")
+    bits = volume.dtype.itemsize * 8
+    if out is None:
+        out = np.empty(volume.shape + (3,), np.uint8)
+
+    clip_limit, gamma = pipeline_settings(modality, subtype, gamma, enhance)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        if clip_limit is not None:
+            if use_3d_clahe:
+                volume = clahe_3d(volume, clip_limit)
+            else:
+                volume = clahe_slices(volume, clip_limit, executor, clahe_max_error)
+
+        if colormap_name != 'crystal':
+            return gather(tone_lut(colormap_name, gamma, blend_factor, bits), volume, out)
+
+        # The crystal map adapts to each slice (its own CLAHE and gray range)
+        toned = gather(gamma_lut(gamma, bits), volume) if gamma != 1.0 else np.asarray(volume)
+        enhanced = clahe_slices(toned, CRYSTAL_CLIP_LIMIT, executor, clahe_max_error)
+        lo = enhanced.min(axis=(1, 2))
+        hi = enhanced.max(axis=(1, 2))
+        if (lo == lo[0]).all() and (hi == hi[0]).all():
+            # Usually every slice spans the same range and shares one table
+            return apply_crystal_tables(toned, enhanced, int(lo[0]), int(hi[0]),
+                                        blend_factor, out=out)
+
+        def color(index):
+            apply_crystal_tables(toned[index], enhanced[index], int(lo[index]),
+                                 int(hi[index]), blend_factor, out=out[index])
+
+        list(executor.map(color, range(volume.shape[0])))
+    return out
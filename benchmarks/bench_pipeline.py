@@ -0,0 +1,180 @@
+"""Benchmark every modality/subtype/colormap path of the colorization engine.
+
+Each case runs on a synthetic phantom in a freshly spawned process, so the
+reported peak RSS belongs to that case alone. Results are written as JSON
+and can be compared against a stored baseline:
+
+    python benchmarks/bench_pipeline.py --output bench.json
+    python benchmarks/bench_pipeline.py --sizes 512 2048 --baseline bench.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'HueMri'))
+
+from engine import MODALITY_COLORMAPS, MODALITY_SUBTYPES  # noqa: E402
+
+DEFAULT_SIZES = (512, 2048, 8192)
+
+
+def synthetic_image(size, seed=0):
+    """Deterministic phantom: concentric tissue rings, a few dense blobs and noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.ogrid[-1:1:size * 1j, -1:1:size * 1j]
+    radius = np.sqrt(x * x + y * y, dtype=np.float32)
+    image = 0.5 + 0.3 * np.cos(radius * 18, dtype=np.float32)
+    image *= radius < 0.95
+    for cy, cx, r in rng.uniform([-0.6, -0.6, 0.05], [0.6, 0.6, 0.2], size=(5, 3)):
+        image += 0.4 * ((x - cx) ** 2 + (y - cy) ** 2 < r * r)
+    image += rng.normal(0, 0.03, image.shape).astype(np.float32)
+    return (np.clip(image, 0, 1) * 255).astype(np.uint8)
+
+
+def peak_rss_mb():
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(case, repeats):
+    """Time one case in the current (fresh) process and return its result record."""
+    import cv2
+    from engine import colorize
+
+    image = synthetic_image(case['size'])
+    settings = dict(modality=case['modality'], subtype=case['subtype'],
+                    colormap_name=case['colormap'])
+    result = dict(case)
+    result['baseline_rss_mb'] = round(peak_rss_mb(), 1)
+    try:
+        # The first call builds the cached tables and CLAHE objects
+        colorize(image, **settings)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            colorize(image, **settings)
+            times.append(time.perf_counter() - start)
+    except Exception as exc:
+        result['error'] = f"{type(exc).__name__}: {exc}"
+        return result
+
+    median = statistics.median(times)
+    result.update(
+        repeats=repeats,
+        wall_s=round(median, 6),
+        min_s=round(min(times), 6),
+        mp_per_s=round(image.size / 1e6 / median, 2),
+        peak_rss_mb=round(peak_rss_mb(), 1),
+        opencv_threads=cv2.getNumThreads(),
+    )
+    return result
+
+
+def build_cases(sizes, modalities=None, colormaps=None):
+    cases = []
+    for size in sizes:
+        for modality, subtypes in MODALITY_SUBTYPES.items():
+            if modalities and modality not in modalities:
+                continue
+            for subtype in subtypes:
+                for colormap in MODALITY_COLORMAPS[modality]:
+                    if colormaps and colormap not in colormaps:
+                        continue
+                    cases.append(dict(modality=modality, subtype=subtype,
+                                      colormap=colormap, size=size))
+    return cases
+
+
+def case_key(result):
+    return (result['modality'], result['subtype'], result['colormap'], result['size'])
+
+
+def compare(results, baseline, threshold):
+    """Print per-case changes against a baseline run; return the regressed cases."""
+    previous = {case_key(entry): entry for entry in baseline['results'] if 'wall_s' in entry}
+    regressions = []
+    for result in results:
+        before = previous.get(case_key(result))
+        if before is None or 'wall_s' not in result:
+            continue
+        change = result['wall_s'] / before['wall_s'] - 1.0
+        if change > threshold:
+            regressions.append(result)
+        marker = "REGRESSION" if change > threshold else ""
+        print(f"{'/'.join(map(str, case_key(result))):<40} "
+              f"{before['wall_s'] * 1000:10.1f} ms -> {result['wall_s'] * 1000:10.1f} ms "
+              f"({change:+.1%}) {marker}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="square image edges to benchmark (default: 512 2048 8192)")
+    parser.add_argument("--modalities", nargs="+", choices=list(MODALITY_SUBTYPES))
+    parser.add_argument("--colormaps", nargs="+")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default="bench_results.json",
+                        help="where to write the JSON results (default: %(default)s)")
+    parser.add_argument("--baseline", help="earlier JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown reported as a regression (default: 0.10)")
+    args = parser.parse_args(argv)
+
+    cases = build_cases(args.sizes, args.modalities, args.colormaps)
+    results = []
+    # A fresh process per case keeps peak RSS and caches independent
+    context = multiprocessing.get_context('spawn')
+    for case in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(run_case, case, args.repeats).result()
+        results.append(result)
+        label = '/'.join(map(str, case_key(result)))
+        if 'error' in result:
+            print(f"{label:<40} ERROR {result['error']}")
+        else:
+            print(f"{label:<40} {result['wall_s'] * 1000:10.1f} ms "
+                  f"{result['mp_per_s']:8.1f} MP/s {result['peak_rss_mb']:8.1f} MB peak RSS")
+
+    import cv2
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {len(results)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nComparison against {args.baseline}:")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than the baseline by more than "
+                  f"{args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
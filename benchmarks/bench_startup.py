@@ -0,0 +1,169 @@
+"""Benchmark cold-start time: module imports, first colorization and worker spawn.
+
+Every case runs in a fresh interpreter, so nothing is imported or cached
+beforehand. The wall time of the whole process is reported next to the
+time of the measured step alone and the heavy libraries it pulled in.
+Results are written as JSON and can be compared against a stored baseline:
+
+    python benchmarks/bench_startup.py --output startup.json
+    python benchmarks/bench_startup.py --repeats 10 --baseline startup.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import subprocess
+
+ENGINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'HueMri')
+
+# Libraries worth knowing about when they show up in a process
+HEAVY_MODULES = ('cv2', 'matplotlib', 'skimage', 'scipy', 'PIL', 'pydicom', 'tkinter')
+
+SETUP = """\
+import numpy as np
+y, x = np.mgrid[:512, :512]
+image = ((x + y) % 256).astype(np.uint8)
+"""
+
+# name -> (setup, measured statement)
+CASES = {
+    "interpreter": ("", "pass"),
+    "import engine": ("", "import engine"),
+    "import batch": ("", "import batch"),
+    "import stream": ("", "import stream"),
+    "import server": ("", "import server"),
+    "import mri": ("", "import mri"),
+    "first colorize 8-bit bone": (
+        SETUP, "from engine import colorize; colorize(image, 'CT', 'standard', 'bone')"),
+    "first colorize 8-bit crystal": (
+        SETUP, "from engine import colorize; colorize(image, 'MRI', '1.5T', 'crystal')"),
+    "first colorize 16-bit hot": (
+        SETUP, "from engine import colorize; colorize(image * np.uint16(257), 'X-ray', "
+               "'standard', 'hot')"),
+    "first colorize 16-bit crystal": (
+        SETUP, "from engine import colorize; colorize(image * np.uint16(257), 'MRI', '3T', "
+               "'crystal')"),
+    # A spawned worker imports the batch and engine modules itself, which
+    # is the cost every batch run pays once per core
+    "spawn batch worker": (
+        SETUP + "import multiprocessing\n"
+                "from concurrent.futures import ProcessPoolExecutor\n"
+                "import batch\n"
+                "from engine import colorize\n",
+        "with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'), "
+        "initializer=batch.init_worker) as executor: "
+        "executor.submit(colorize, image, 'CT', 'standard', 'bone').result()"),
+}
+
+CHILD = """\
+import sys, time, json
+{setup}
+before = set(sys.modules)
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+heavy = {heavy!r}
+loaded = sorted(name for name in set(sys.modules) - before
+                if '.' not in name and name in heavy)
+print(json.dumps(dict(step_s=seconds, loaded=loaded)))
+"""
+
+
+def run_case(name, repeats):
+    """Run one case in repeats fresh interpreters and return its result record."""
+    setup, statement = CASES[name]
+    code = CHILD.format(setup=setup, statement=statement, heavy=HEAVY_MODULES)
+    walls, steps = [], []
+    result = dict(case=name)
+    for _ in range(repeats):
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, "-c", code], cwd=ENGINE_DIR,
+                                 capture_output=True, text=True)
+        wall = time.perf_counter() - start
+        if process.returncode != 0:
+            lines = process.stderr.strip().splitlines()
+            result['error'] = lines[-1] if lines else f"exit status {process.returncode}"
+            return result
+        child = json.loads(process.stdout.strip().splitlines()[-1])
+        walls.append(wall)
+        steps.append(child['step_s'])
+    result.update(
+        repeats=repeats,
+        wall_s=round(statistics.median(walls), 4),
+        min_wall_s=round(min(walls), 4),
+        step_s=round(statistics.median(steps), 4),
+        loaded=child['loaded'],
+    )
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Print per-case changes against a baseline run; return the regressed cases."""
+    previous = {entry['case']: entry for entry in baseline['results'] if 'wall_s' in entry}
+    regressions = []
+    for result in results:
+        before = previous.get(result['case'])
+        if before is None or 'wall_s' not in result:
+            continue
+        change = result['wall_s'] / before['wall_s'] - 1.0
+        if change > threshold:
+            regressions.append(result)
+        marker = "REGRESSION" if change > threshold else ""
+        print(f"{result['case']:<32} {before['wall_s'] * 1000:8.0f} ms -> "
+              f"{result['wall_s'] * 1000:8.0f} ms ({change:+.1%}) {marker}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), metavar="CASE",
+                        help="cases to run (default: all)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default="startup_results.json",
+                        help="where to write the JSON results (default: %(default)s)")
+    parser.add_argument("--baseline", help="earlier JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown reported as a regression (default: 0.10)")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.cases or CASES:
+        result = run_case(name, args.repeats)
+        results.append(result)
+        if 'error' in result:
+            print(f"{name:<32} ERROR {result['error']}")
+        else:
+            print(f"{name:<32} {result['wall_s'] * 1000:8.0f} ms process "
+                  f"{result['step_s'] * 1000:8.0f} ms step  "
+                  f"loads: {', '.join(result['loaded']) or '-'}")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {len(results)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nComparison against {args.baseline}:")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than the baseline by more than "
+                  f"{args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""Check that colorize() stays within its budget of full-frame buffers.
+
+engine.py documents which full-frame buffers a call allocates. This script
+traces the peak memory of one call per pipeline path with tracemalloc
+(which sees NumPy and OpenCV allocations), expresses it in frames of
+H x W bytes, and fails if any path exceeds its budget:
+
+    python benchmarks/check_allocations.py
+"""
+import os
+import sys
+import argparse
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'HueMri'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_pipeline import synthetic_image  # noqa: E402
+from engine import colorize  # noqa: E402
+
+# (name, colorize settings, budget in uint8 frames without out, with out)
+CASES = [
+    ("colormap", dict(colormap_name='bone', gamma=1.2), 1 + 3, 1),
+    ("colormap, no CLAHE", dict(colormap_name='bone', enhance=False), 3, 0),
+    ("crystal", dict(colormap_name='crystal', gamma=1.2), 1 + 1 + 1 + 2 + 3, 1 + 1 + 1 + 2),
+    ("crystal, no blend", dict(colormap_name='crystal', blend_factor=0.0), 1 + 1 + 3, 1 + 1),
+]
+
+# Tables, CLAHE state and interpreter noise, in frames
+SLACK = 0.25
+
+
+def peak_frames(image, settings, out=None):
+    tracemalloc.start()
+    try:
+        result = colorize(image, **settings, out=out)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak / image.size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=2048)
+    args = parser.parse_args(argv)
+
+    image = synthetic_image(args.size)
+    out = np.empty(image.shape + (3,), np.uint8)
+    failures = 0
+    for name, settings, budget, budget_with_out in CASES:
+        settings = dict(modality="MRI", subtype="1.5T", **settings)
+        # Build the cached tables and CLAHE objects outside the trace
+        colorize(image, **settings)
+        for label, target, limit in ((name, None, budget),
+                                     (f"{name}, into out", out, budget_with_out)):
+            frames = peak_frames(image, settings, target)
+            ok = frames <= limit + SLACK
+            failures += not ok
+            print(f"{label:<28} {frames:6.2f} frames (budget {limit}) {'ok' if ok else 'OVER'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
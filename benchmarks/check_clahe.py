@@ -0,0 +1,104 @@
+"""Check that the block-wise CLAHE and tiled paths match OpenCV and engine.colorize().
+
+clahe.py reproduces cv2.CLAHE, including the REFLECT_101 padding OpenCV
+adds to images off the 8x8 grid. Small and narrow images pad by more than
+an axis is long, so this script runs a set of such shapes (and a few
+ordinary ones) at 8 and 16 bits through the streaming, banded and tiled
+paths, and through colorize_variants() and colorize_volume(), which take
+16-bit images through clahe.py too. It fails on any mismatch or error:
+
+    python benchmarks/check_clahe.py
+"""
+import os
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'HueMri'))
+
+from clahe import apply_clahe  # noqa: E402
+from engine import colorize, colorize_variants  # noqa: E402
+from tiled import colorize_tiled  # noqa: E402
+from volume import colorize_volume  # noqa: E402
+
+SHAPES = [(1, 1), (1, 7), (7, 1), (2, 2), (3, 5), (9, 9), (17, 3), (5, 300),
+          (513, 8), (8, 513), (100, 37), (64, 64), (250, 190)]
+
+CLIP_LIMIT = 3.0
+
+
+def random_image(shape, dtype, rng):
+    return rng.integers(0, np.iinfo(dtype).max + 1, shape).astype(dtype)
+
+
+def check_clahe(image, executor):
+    """Names of the CLAHE paths whose result differs from cv2.CLAHE."""
+    expected = cv2.createCLAHE(CLIP_LIMIT, (8, 8)).apply(image)
+    paths = {
+        "streaming": lambda: apply_clahe(image, CLIP_LIMIT, block_rows=16),
+        "banded": lambda: apply_clahe(image, CLIP_LIMIT, executor=executor),
+    }
+    return [name for name, run in paths.items() if not _same(run, expected)]
+
+
+def check_pipeline(image):
+    """Paths whose result differs from engine.colorize() with the same colormap."""
+    failed = []
+    for colormap in ('bone', 'crystal'):
+        pipeline = dict(modality="MRI", subtype="1.5T")
+        settings = dict(pipeline, colormap_name=colormap)
+        paths = {
+            "tiled": lambda: colorize_tiled(image, block_size=(16, 16), **settings),
+            "variants": lambda: colorize_variants(image, [colormap], **pipeline)[0],
+            "volume": lambda: colorize_volume(image[np.newaxis], **settings)[0],
+        }
+        # A constant image has an empty crystal range, which divides by zero
+        with np.errstate(divide='ignore', invalid='ignore'):
+            expected = _run(lambda: colorize(image, **settings))
+            if expected is None:
+                failed.append(f"colorize {colormap}")
+                continue
+            failed += [f"{name} {colormap}" for name, run in paths.items()
+                       if not _same(run, expected)]
+    return failed
+
+
+def _run(run):
+    try:
+        return run()
+    except Exception as exc:
+        print(f"    {type(exc).__name__}: {exc}")
+        return None
+
+
+def _same(run, expected):
+    result = _run(run)
+    return result is not None and np.array_equal(result, expected)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    failures = 0
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for dtype in (np.uint8, np.uint16):
+            for shape in SHAPES:
+                image = random_image(shape, dtype, rng)
+                failed = check_clahe(image, executor) + check_pipeline(image)
+                failures += bool(failed)
+                print(f"{np.dtype(dtype).name:<7} {str(shape):<12} "
+                      f"{'FAILED ' + ', '.join(failed) if failed else 'ok'}")
+    if failures:
+        print(f"\n{failures} shape(s) failed")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
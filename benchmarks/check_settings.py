@@ -0,0 +1,76 @@
+"""Check that invalid pipeline settings are rejected at every entry point.
+
+A negative gamma has no meaningful curve: 8-bit tables would come out all
+white and 16-bit tables garbage. This script passes one to the engine, the
+shared command-line flags and the server's query parser, and fails unless
+each rejects it with its own error (ValueError, a usage error, a 400):
+
+    python benchmarks/check_settings.py
+"""
+import os
+import sys
+import argparse
+import contextlib
+import io
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'HueMri'))
+
+from batch import add_pipeline_arguments, pipeline_settings_from_args  # noqa: E402
+from engine import colorize, gamma_lut  # noqa: E402
+from server import RequestError, parse_settings  # noqa: E402
+
+BAD_GAMMAS = [-1.0, -0.5, float('nan')]
+
+
+def engine_rejects(gamma):
+    image = np.zeros((16, 16), np.uint16)
+    calls = [lambda: gamma_lut(gamma), lambda: gamma_lut(gamma, 16),
+             lambda: colorize(image, colormap_name='bone', gamma=gamma),
+             lambda: colorize(image, colormap_name='crystal', gamma=gamma)]
+    for call in calls:
+        try:
+            call()
+        except ValueError:
+            continue
+        return False
+    return True
+
+
+def flags_reject(gamma):
+    parser = argparse.ArgumentParser()
+    add_pipeline_arguments(parser)
+    args = parser.parse_args([f"--gamma={gamma}"])
+    try:
+        with contextlib.redirect_stderr(io.StringIO()):
+            pipeline_settings_from_args(parser, args)
+    except SystemExit as exc:
+        return exc.code == 2
+    return False
+
+
+def server_rejects(gamma):
+    try:
+        parse_settings(f"gamma={gamma}")
+    except RequestError as exc:
+        return exc.status == 400
+    return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.parse_args(argv)
+
+    failures = 0
+    for gamma in BAD_GAMMAS:
+        for name, check in (("engine", engine_rejects), ("flags", flags_reject),
+                            ("server", server_rejects)):
+            ok = check(gamma)
+            failures += not ok
+            print(f"gamma={gamma:<5} {name:<7} {'ok' if ok else 'ACCEPTED'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
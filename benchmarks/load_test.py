@@ -0,0 +1,98 @@
+"""Load-test a running colorization server (HueMri/server.py).
+
+    python HueMri/server.py --port 8765 &
+    python benchmarks/load_test.py --url http://127.0.0.1:8765 --concurrency 8 --requests 200
+
+Each client thread keeps one connection open and posts synthetic images;
+the client-side latency distribution, throughput and the server's own
+/stats are printed at the end.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_pipeline import synthetic_image  # noqa: E402
+
+
+def encode_png(image):
+    import cv2
+
+    ok, encoded = cv2.imencode('.png', image)
+    return encoded.tobytes()
+
+
+def client(url, path, body, count, latencies, failures):
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=120)
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            connection.request("POST", path, body, {"Content-Type": "application/octet-stream"})
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                failures.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as exc:
+            failures.append(type(exc).__name__)
+            connection.close()
+            connection = http.client.HTTPConnection(url.hostname, url.port, timeout=120)
+            continue
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="total requests")
+    parser.add_argument("--size", type=int, default=512, help="synthetic image edge")
+    parser.add_argument("--modality", default="CT")
+    parser.add_argument("--subtype", default="standard")
+    parser.add_argument("--colormap", default="bone")
+    parser.add_argument("--format", choices=("png", "npy"), default="png")
+    args = parser.parse_args(argv)
+
+    url = urlsplit(args.url)
+    query = urlencode({"modality": args.modality, "subtype": args.subtype,
+                       "colormap": args.colormap, "format": args.format})
+    path = f"/colorize?{query}"
+    body = encode_png(synthetic_image(args.size))
+
+    latencies, failures = [], []
+    per_client = [args.requests // args.concurrency
+                  + (i < args.requests % args.concurrency) for i in range(args.concurrency)]
+    threads = [threading.Thread(target=client, args=(url, path, body, n, latencies, failures))
+               for n in per_client]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(latencies)} ok, {len(failures)} failed in {elapsed:.2f} s "
+          f"({len(latencies) / elapsed:.1f} req/s, concurrency {args.concurrency})")
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        print(f"latency p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms")
+    if failures:
+        print(f"failures: {sorted(set(map(str, failures)))}")
+
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=10)
+    connection.request("GET", "/stats")
+    print("server stats:", json.dumps(json.loads(connection.getresponse().read()), indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())